@@ -1,49 +1,84 @@
-import os
 import json
 import logging
+import mmap
+from pathlib import Path
 from memory import MemoryManager
 import storage
 
+# [Perf] SIMD-accelerated parser over an mmap'd buffer: zero-copy read and
+# lazy materialization (only the id fields become Python objects). Optional.
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+# [Perf] Streaming parser: plucks ids without materializing the whole history DOM.
+# Optional - falls back to json.load if not installed.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# [Perf] Faster full-document fallback when ijson is unavailable.
+try:
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 SESSION_ID = "3b986ef3"
-SESSION_FILE = f"data/sessions/{SESSION_ID}.json"
+SESSION_FILE = Path(f"data/sessions/{SESSION_ID}.json")
 
 def cleanup():
     # 1. Init Memory
     mm = MemoryManager()
-    
+
     # 2. Load Session to find Linked Memories
-    linked_deleted_count = 0
-    if os.path.exists(SESSION_FILE):
-        try:
-            with open(SESSION_FILE, "r") as f:
-                data = json.load(f)
-                
+    # [Perf] No os.path.exists pre-checks: open once and catch FileNotFoundError,
+    # which drops the redundant stat() calls and the TOCTOU window.
+    session_existed = True
+    try:
+        if simdjson is not None:
+            # mmap + simdjson: the kernel pages the file in, the SIMD scanner
+            # finds structure, and only 'id' strings are materialized.
+            with open(SESSION_FILE, "rb") as f:
+                mm_buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                doc = None
+                try:
+                    doc = simdjson.Parser().parse(mm_buf)
+                    ids = [m["id"] for m in doc["history"] if "id" in m]
+                finally:
+                    del doc  # Release parser views before unmapping
+                    mm_buf.close()
+        elif ijson is not None:
+            # Stream only the message ids - O(#ids) memory instead of O(full history)
+            with open(SESSION_FILE, "rb") as f:
+                ids = [v for v in ijson.items(f, "history.item.id") if v]
+        else:
+            data = _loads(SESSION_FILE.read_bytes())
             history = data.get("history", [])
-            logging.info(f"Scanning {len(history)} messages for linked memories...")
-            
-            for msg in history:
-                msg_id = msg.get("id")
-                if msg_id:
-                    count = mm.delete_memory_by_source(msg_id)
-                    linked_deleted_count += count
-            
-            logging.info(f"Deleted {linked_deleted_count} linked memories.")
-            
-        except Exception as e:
-            logging.error(f"Error scanning session file: {e}")
-    else:
-        logging.warning(f"Session file {SESSION_FILE} not found. Skipping memory scan.")
+            ids = [msg["id"] for msg in history if msg.get("id")]
+
+        logging.info("Scanning %d linked message ids...", len(ids))
+
+        # [Perf] Collect ids first, then delete in one bulk pass (one save instead of N)
+        linked_deleted_count = mm.delete_memory_by_sources(ids)
+
+        logging.info("Deleted %d linked memories.", linked_deleted_count)
+
+    except FileNotFoundError:
+        session_existed = False
+        logging.warning("Session file %s not found. Skipping memory scan.", SESSION_FILE)
+    except Exception as e:
+        logging.error("Error scanning session file: %s", e)
 
-    # 3. Clear Scheduled Tasks (Decision Records)
-    logging.info("Clearing scheduled tasks...")
-    storage.clear_session_tasks(SESSION_ID)
+    # 3. Clear Scheduled Tasks + Session File in one storage pass
+    logging.info("Clearing scheduled tasks and session file...")
+    result = storage.session_cleanup(SESSION_ID)
 
-    # 4. Delete Session File
-    if os.path.exists(SESSION_FILE):
-        os.remove(SESSION_FILE)
+    if result["session_removed"] or session_existed:
         logging.info("Session file deleted.")
         print(f"SUCCESS: Session {SESSION_ID} and all related data (Tasks, Memories) eradicated.")
     else:
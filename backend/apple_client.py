@@ -1,30 +1,112 @@
 import subprocess
+import threading
 import time
+import uuid
+
+# [Perf] EventKit 直连 (PyObjC)
+# 能 import 到 EventKit 时直接走进程内 API：省掉 osascript 解释器和
+# Apple Events 序列化，单次提醒从百毫秒级降到毫秒级。
+# 非 mac / 未装 PyObjC 时自动回退到下面的 osascript 协进程路径。
+try:
+    from EventKit import EKEventStore, EKReminder, EKEntityTypeReminder
+    from Foundation import NSCalendar, NSDate
+
+    _store = EKEventStore.alloc().init()
+    _store.requestAccessToEntityType_completion_(EKEntityTypeReminder, None)
+except ImportError:
+    _store = None
+
+# [Perf] 持久化 osascript 协进程
+# 每次 send_to_reminders 都 fork+exec 一个新的 osascript (~100-300ms)，
+# 高频提醒时这个固定开销占大头。改为常驻一个 `osascript -i` 交互进程，
+# 把脚本写进 stdin、读 stdout，把启动成本摊薄到所有调用上。
+_proc = None
+_proc_lock = threading.Lock()
+
+
+def _escape(text: str) -> str:
+    """转义 AppleScript 字符串，防止引号/换行破坏脚本 (也防注入)。"""
+    return text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ").replace("\r", " ")
+
+
+def _get_proc():
+    """懒启动 (或在进程死掉后重启) 常驻 osascript。"""
+    global _proc
+    if _proc is None or _proc.poll() is not None:
+        _proc = subprocess.Popen(
+            ["osascript", "-i"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+    return _proc
+
+
+def _send_via_eventkit(title: str, body: str) -> bool:
+    """进程内 EventKit 路径：无 fork/exec，无 AppleScript 解析。"""
+    try:
+        reminder = EKReminder.reminderWithEventStore_(_store)
+        reminder.setTitle_(title)
+        reminder.setNotes_(body)
+        reminder.setCalendar_(_store.defaultCalendarForNewReminders())
+        # 到期时间 = 现在，触发立即通知/同步
+        units = (1 << 2) | (1 << 3) | (1 << 4) | (1 << 5) | (1 << 6)  # Y/M/D/H/Min
+        components = NSCalendar.currentCalendar().components_fromDate_(units, NSDate.date())
+        reminder.setDueDateComponents_(components)
+
+        ok, error = _store.saveReminder_commit_error_(reminder, True, None)
+        if ok:
+            print(f"[Apple] Notification sent via EventKit: {title}")
+            return True
+        print(f"[Apple] EventKit Error: {error}")
+        return False
+    except Exception as e:
+        print(f"[Apple] EventKit Exception: {e}")
+        return False
+
 
 def send_to_reminders(title: str, body: str = "来自 AI 的关心"):
     """
-    通过 AppleScript 将消息发送到 macOS/iOS '提醒事项'。
+    将消息发送到 macOS/iOS '提醒事项'。
     这会触发 iCloud 同步，导致 iPhone/Watch 震动。
+    优先走进程内 EventKit，失败/不可用时回退 osascript。
     """
-    # AppleScript: 创建一个立即到期的提醒，以触发通知
-    script = f'''
-    tell application "Reminders"
-        make new reminder with properties {{name:"{title}", body:"{body}", remind me date:(current date)}}
-    end tell
-    '''
-    
-    try:
-        # 运行 osascript
-        result = subprocess.run(["osascript", "-e", script], capture_output=True, text=True)
-        if result.returncode == 0:
-            print(f"[Apple] Notification sent: {title}")
-            return True
-        else:
-            print(f"[Apple] Error: {result.stderr}")
+    global _proc
+
+    if _store is not None and _send_via_eventkit(title, body):
+        return True
+    title = _escape(title)
+    body = _escape(body)
+
+    # 哨兵行：读到它说明本次脚本执行完毕 (osascript -i 会回显 return 值)
+    sentinel = f"OK:{uuid.uuid4().hex}"
+    script = (
+        f'tell application "Reminders" to make new reminder with properties '
+        f'{{name:"{title}", body:"{body}", remind me date:(current date)}}\n'
+        f'return "{sentinel}"\n'
+    )
+
+    with _proc_lock:
+        try:
+            proc = _get_proc()
+            proc.stdin.write(script)
+            proc.stdin.flush()
+
+            # 读到哨兵为止；进程退出则视为失败
+            while True:
+                line = proc.stdout.readline()
+                if not line:
+                    print("[Apple] Error: osascript process died.")
+                    _proc = None
+                    return False
+                if sentinel in line:
+                    print(f"[Apple] Notification sent: {title}")
+                    return True
+        except Exception as e:
+            print(f"[Apple] Exception: {e}")
+            _proc = None  # 下次调用重新拉起
             return False
-    except Exception as e:
-        print(f"[Apple] Exception: {e}")
-        return False
 
 if __name__ == "__main__":
     # Test
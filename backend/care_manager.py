@@ -1,119 +1,337 @@
+import atexit
+import heapq
 import json
+import logging
 import os
+import threading
 import time
-import uuid
+from dataclasses import dataclass
 from typing import Dict, List, Any, Optional
 
+# [Perf] Lazy %s formatting: no string building at all when the level is off,
+# and no stdout flush syscalls on hot add/update loops.
+logger = logging.getLogger(__name__)
+
+# [Perf] orjson is a C JSON engine, ~5-10x faster than stdlib for both
+# encode and decode. Optional - stdlib fallback keeps the same call shape.
+try:
+    import orjson
+
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+    _loads = json.loads
+
+# [Perf] Binary on-disk format: msgpack is roughly half the bytes of indented
+# JSON and 3-5x faster to parse. Optional - without it the list stays JSON.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# [Perf] Slotted item instead of an 8-key dict: a few times smaller per item,
+# no per-instance hash table, and attribute access beats dict lookups in the
+# hot filter/format loops. Dicts only appear at the JSON boundaries
+# (disk, API responses, LLM prompts) via to_dict/from_dict.
+@dataclass(slots=True)
+class CareItem:
+    id: str
+    type: str            # one_off | recurring
+    category: str        # health | work | mood | routine
+    content: str
+    trigger_time: float
+    recurrence_rule: Optional[str]
+    status: str
+    created_at: float
+    dt_str: str = ""     # Cached absolute-time string; never persisted
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "category": self.category,
+            "content": self.content,
+            "trigger_time": self.trigger_time,
+            "recurrence_rule": self.recurrence_rule,
+            "status": self.status,
+            "created_at": self.created_at,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "CareItem":
+        return cls(
+            id=d.get("id", ""),
+            type=d.get("type", "one_off"),
+            category=d.get("category", "general"),
+            content=d.get("content", ""),
+            trigger_time=d.get("trigger_time", 0.0),
+            recurrence_rule=d.get("recurrence_rule"),
+            status=d.get("status", "pending"),
+            created_at=d.get("created_at", 0.0),
+        )
+
+
 class CareManager:
     def __init__(self, data_path: str = "./data/care_list.json"):
         self.data_path = data_path
+        self._binary = False
+        if msgpack is not None and data_path.endswith(".json"):
+            # Binary store available: switch the target to .msgpack and
+            # migrate an existing JSON file once (old file kept as .bak).
+            legacy_path = data_path
+            self.data_path = data_path[:-len(".json")] + ".msgpack"
+            self._binary = True
+            self._ensure_data_dir()
+            if os.path.exists(legacy_path) and not os.path.exists(self.data_path):
+                self._migrate_legacy_json(legacy_path)
         self._ensure_data_dir()
         self.care_list = self._load_data()
+        # Hydrate raw dicts into slotted items
+        self.care_list["items"] = [CareItem.from_dict(i) for i in self.care_list["items"]]
+        # [Perf] Secondary index: id -> item, so status updates don't scan the list
+        self._by_id: Dict[str, CareItem] = {i.id: i for i in self.care_list["items"] if i.id}
+        # [Perf] Min-heap of (trigger_time, id) over pending items.
+        # Stale entries (completed/removed ids) are skipped lazily on pop.
+        self._pending_heap: List[tuple] = [
+            (i.trigger_time, i.id)
+            for i in self.care_list["items"]
+            if i.status == "pending"
+        ]
+        heapq.heapify(self._pending_heap)
+        # [Concurrency] The deferred save runs on a Timer thread while
+        # mutations happen on the event-loop thread; one reentrant lock
+        # covers both so compaction can't drop a concurrent append.
+        self._lock = threading.RLock()
+        # [Perf] Write coalescing: mutations mark dirty and schedule one
+        # deferred save instead of rewriting the file per call.
+        self._dirty = False
+        self._flush_interval = 1.0
+        self._flush_timer: Optional[threading.Timer] = None
+        atexit.register(self.flush)
+        # [Perf] Memo for get_context_string: (revision, minute-bucket, text).
+        # Revision bumps on every mutation; minute bucket covers the relative
+        # time strings ("X 分钟后") going stale.
+        self._rev = 0
+        self._ctx_cache: tuple = (None, None, None)
+        # [Perf] Tombstoned (completed) item ids. Deletion is O(1); the items
+        # list is only compacted when tombstones pile up (>25%) or at save.
+        self._tombstones: set = set()
+
+    def _mark_dirty(self):
+        """Schedule a single deferred save_data (cancel-and-reschedule)."""
+        with self._lock:
+            self._dirty = True
+            self._rev += 1
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(self._flush_interval, self.save_data)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """Force any pending coalesced write to disk immediately."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._dirty:
+                self.save_data()
+
+    def _maybe_compact(self, force: bool = False):
+        """Drop tombstoned items from the list once they exceed 25% (or on save)."""
+        with self._lock:
+            if not self._tombstones:
+                return
+            if force or len(self._tombstones) > len(self.care_list["items"]) // 4:
+                dead = self._tombstones
+                self.care_list["items"] = [
+                    i for i in self.care_list["items"] if i.id not in dead
+                ]
+                self._tombstones = set()
+
+    def _heap_entry_alive(self, item_id: str) -> bool:
+        item = self._by_id.get(item_id)
+        return item is not None and item.status == "pending"
 
     def _ensure_data_dir(self):
         os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
 
+    def _encode(self, data) -> bytes:
+        if self._binary:
+            return msgpack.packb(data, use_bin_type=True)
+        return _dumps(data)
+
+    def _decode(self, buf: bytes):
+        if self._binary:
+            return msgpack.unpackb(buf, raw=False)
+        return _loads(buf)
+
+    def _migrate_legacy_json(self, legacy_path: str):
+        """One-shot JSON -> msgpack migration; the JSON file is kept as .bak."""
+        try:
+            with open(legacy_path, "rb") as f:
+                data = _loads(f.read())
+            self._atomic_write(msgpack.packb(data, use_bin_type=True))
+            os.replace(legacy_path, legacy_path + ".bak")
+            logger.info("[CareManager] Migrated %s to msgpack.", legacy_path)
+        except Exception as e:
+            logger.error("[CareManager] Migration failed: %s", e)
+
     def _load_data(self) -> Dict[str, Any]:
         if os.path.exists(self.data_path):
             try:
-                with open(self.data_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    
+                with open(self.data_path, "rb") as f:
+                    data = self._decode(f.read())
+
                 # [Auto-Cleanup] Purge completed items heavily
+                # Cheap short-circuit first: the common case (nothing completed)
+                # skips the O(N) rebuild entirely.
                 items = data.get("items", [])
-                original_count = len(items)
-                active_items = [i for i in items if i.get("status") != "completed"]
-                
-                if len(active_items) < original_count:
-                    print(f"[CareManager] Auto-cleaned {original_count - len(active_items)} completed items.")
+                if any(i.get("status") == "completed" for i in items):
+                    original_count = len(items)
+                    active_items = [i for i in items if i.get("status") != "completed"]
+                    purged = original_count - len(active_items)
+                    logger.debug("[CareManager] Auto-cleaned %d completed items.", purged)
                     data["items"] = active_items
-                    # Save back immediately to effectively scrub the file
-                    # We can't call save_data() here because it might overwrite what we just loaded if not careful,
-                    # but since we are in _load_data, self.care_list isn't set yet.
-                    # It's safer to just return cleaned data and let the first add/update save it,
-                    # OR we can write it back now. Writing back is cleaner to ensure file is small.
-                    try:
-                        with open(self.data_path, "w", encoding="utf-8") as f:
-                            json.dump(data, f, ensure_ascii=False, indent=2)
-                    except: pass
-                    
+
+                    # Only rewrite the file when the purge is worth the I/O
+                    # (>10% of items or >50 absolute). Small purges get picked
+                    # up by the next regular save anyway.
+                    if purged / max(original_count, 1) > 0.1 or purged > 50:
+                        try:
+                            self._atomic_write(self._encode(data))
+                        except Exception as e:
+                            logger.error("[CareManager] Cleanup write-back failed: %s", e)
+
                 return data
             except Exception as e:
-                print(f"[CareManager] Load failed: {e}")
-        
+                logger.error("[CareManager] Load failed: %s", e)
+
         # Default Structure
         return {
             "last_updated": 0,
             "items": []
         }
 
+    def _atomic_write(self, payload: bytes):
+        """
+        Single-buffer write + atomic rename.
+        A crash mid-write leaves the old file intact instead of a truncated one.
+        """
+        tmp_path = self.data_path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, payload)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, self.data_path)
+
     def save_data(self):
         """Persist care list to disk."""
-        self.care_list["last_updated"] = time.time()
-        try:
-            with open(self.data_path, "w", encoding="utf-8") as f:
-                json.dump(self.care_list, f, ensure_ascii=False, indent=2)
-            # print(f"[CareManager] Saved {len(self.care_list['items'])} items.")
-        except Exception as e:
-            print(f"[CareManager] Save failed: {e}")
+        with self._lock:
+            self._maybe_compact(force=True)
+            self.care_list["last_updated"] = time.time()
+            try:
+                # Serialize fully in memory first: one write() syscall instead
+                # of many small writes against the file object.
+                data = dict(self.care_list)
+                data["items"] = [i.to_dict() for i in self.care_list["items"]]
+                self._atomic_write(self._encode(data))
+                # Cleared only after a successful write so a failed save
+                # stays dirty and retries on the next flush.
+                self._dirty = False
+                logger.debug("[CareManager] Saved %d items.", len(self.care_list["items"]))
+            except Exception as e:
+                logger.error("[CareManager] Save failed: %s", e)
 
     def add_item(self, category: str, content: str, trigger_time: float, type: str = "one_off", recurrence: str = None) -> str:
         """Add a new care item."""
-        new_item = {
-            "id": str(uuid.uuid4()),
-            "type": type, # one_off | recurring
-            "category": category, # health | work | mood | routine
-            "content": content,
-            "trigger_time": trigger_time,
-            "recurrence_rule": recurrence,
-            "status": "pending",
-            "created_at": time.time()
-        }
-        self.care_list["items"].append(new_item)
-        self.save_data()
-        return new_item["id"]
+        new_item = CareItem(
+            # [Perf] Raw hex token: skips UUID object construction/formatting,
+            # ids are only opaque keys here (32 hex chars, collision-safe).
+            id=os.urandom(16).hex(),
+            type=type, # one_off | recurring
+            category=category, # health | work | mood | routine
+            content=content,
+            trigger_time=trigger_time,
+            recurrence_rule=recurrence,
+            status="pending",
+            created_at=time.time(),
+            # [Perf] Absolute time string never changes - format it once here
+            # instead of strftime-ing per context build.
+            dt_str=time.strftime("%Y-%m-%d %H:%M", time.localtime(trigger_time)),
+        )
+        with self._lock:
+            self.care_list["items"].append(new_item)
+            self._by_id[new_item.id] = new_item
+            heapq.heappush(self._pending_heap, (trigger_time, new_item.id))
+            self._mark_dirty()
+        return new_item.id
 
     def update_item_status(self, item_id: str, status: str):
         """
-        Update status. 
+        Update status.
         [Auto-Delete] If status is 'completed', REMOVE it from the list entirely.
         """
-        original_count = len(self.care_list["items"])
-        
-        if status == "completed":
-            # Remove item
-            self.care_list["items"] = [
-                item for item in self.care_list["items"] 
-                if item["id"] != item_id
-            ]
-            if len(self.care_list["items"]) < original_count:
-                print(f"[CareManager] Auto-deleted completed item: {item_id}")
-        else:
-            # Update status
-            for item in self.care_list["items"]:
-                if item["id"] == item_id:
-                    item["status"] = status
-                    break
-        
-        self.save_data()
+        with self._lock:
+            item = self._by_id.get(item_id)
+
+            if status == "completed":
+                if item is not None:
+                    # Tombstone instead of rebuilding the list: O(1) amortized.
+                    # Readers filter on status, compaction happens lazily.
+                    item.status = "completed"
+                    self._by_id.pop(item_id, None)
+                    self._tombstones.add(item_id)
+                    self._maybe_compact()
+                    logger.debug("[CareManager] Auto-deleted completed item: %s", item_id)
+            elif item is not None:
+                # Update status via O(1) index lookup
+                was_pending = item.status == "pending"
+                item.status = status
+                if status == "pending" and not was_pending:
+                    heapq.heappush(self._pending_heap, (item.trigger_time, item_id))
+
+            self._mark_dirty()
+
+    def get_all_items(self) -> List[Dict]:
+        """Plain-dict snapshot of every item, for JSON boundaries (prompts, APIs)."""
+        return [i.to_dict() for i in self.care_list["items"]]
 
     def get_pending_items(self) -> List[Dict]:
-        """Get all pending items sorted by trigger time."""
-        pending = [i for i in self.care_list["items"] if i["status"] == "pending"]
-        pending.sort(key=lambda x: x["trigger_time"])
-        return pending
+        """Get all pending items sorted by trigger time (as plain dicts)."""
+        pending = [i for i in self.care_list["items"] if i.status == "pending"]
+        pending.sort(key=lambda x: x.trigger_time)
+        return [i.to_dict() for i in pending]
 
     def get_due_items(self, buffer_seconds: int = 300) -> List[Dict]:
         """
         Get items that are due now or within buffer window.
         Items are considered due if trigger_time <= now + buffer.
+        Single pass over the due prefix of the heap - never re-filters or
+        re-sorts the full pending list per poll.
         """
-        now = time.time()
+        threshold = time.time() + buffer_seconds
         due = []
-        for item in self.get_pending_items():
-            # If time is in the past OR nearing future (within buffer)
-            if item["trigger_time"] <= (now + buffer_seconds):
-                due.append(item)
+        popped = []
+        # Peek the heap: only due entries (and stale tombstones) are touched,
+        # non-due items never leave the heap. O(k log N) per poll.
+        while self._pending_heap and self._pending_heap[0][0] <= threshold:
+            entry = heapq.heappop(self._pending_heap)
+            if not self._heap_entry_alive(entry[1]):
+                continue  # Stale (completed/removed) - drop permanently
+            due.append(self._by_id[entry[1]].to_dict())
+            popped.append(entry)
+        # Items are still pending until someone completes them - keep them polled
+        for entry in popped:
+            heapq.heappush(self._pending_heap, entry)
         return due
 
     def get_context_string(self) -> str:
@@ -121,24 +339,38 @@ class CareManager:
         Format pending care items for LLM Context.
         Prioritizes immediate upcoming items.
         """
-        pending = self.get_pending_items()
+        key = (self._rev, int(time.time() // 60))
+        if key == self._ctx_cache[:2]:
+            return self._ctx_cache[2]
+
+        pending = [i for i in self.care_list["items"] if i.status == "pending"]
         if not pending:
-            return "当前无任何特别关心事项。"
-        
+            result = "当前无任何特别关心事项。"
+            self._ctx_cache = (key[0], key[1], result)
+            return result
+
         lines = ["【待办关心事项 (Care List)】"]
         now = time.time()
-        
-        for item in pending[:5]: # Only show top 5 nearest
-            dt = time.strftime("%Y-%m-%d %H:%M", time.localtime(item["trigger_time"]))
-            delta = item["trigger_time"] - now
-            
+
+        # [Perf] O(N log 5) partial selection instead of sorting the whole list
+        top = heapq.nsmallest(5, pending, key=lambda x: x.trigger_time)
+        for item in top: # Only show top 5 nearest
+            if not item.dt_str:
+                # Loaded-from-disk items: format once, then reuse
+                item.dt_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(item.trigger_time))
+            # [Perf] Only the relative delta is computed per call (integer math);
+            # the absolute time string was formatted once at add/load time.
+            delta = int(item.trigger_time - now)
+
             if delta < 0:
-                time_desc = f"已超时 {int(abs(delta)/60)} 分钟"
+                time_desc = f"已超时 {-delta // 60} 分钟"
             elif delta < 3600:
-                time_desc = f"{int(delta/60)} 分钟后"
+                time_desc = f"{delta // 60} 分钟后"
             else:
-                time_desc = f"{int(delta/3600)} 小时后"
-                
-            lines.append(f"- [{item['category']}] {item['content']} (时间: {dt}, 状态: {time_desc})")
-            
-        return "\n".join(lines)
+                time_desc = f"{delta // 3600} 小时后"
+
+            lines.append(f"- [{item.category}] {item.content} (时间: {item.dt_str}, 状态: {time_desc})")
+
+        result = "\n".join(lines)
+        self._ctx_cache = (key[0], key[1], result)
+        return result
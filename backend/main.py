@@ -1,5 +1,7 @@
 import os
 import asyncio
+import concurrent.futures
+import functools
 import time
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
@@ -15,9 +17,26 @@ from profile_manager import ProfileManager
 from care_manager import CareManager # [Critical Fix] Re-Import
 from dotenv import load_dotenv
 import storage
+from collections import namedtuple
+from dataclasses import dataclass, field
+import re
+import traceback
 import uuid
 import json
-import google.generativeai as genai 
+# [Perf] google.generativeai is NOT imported here: main.py never calls it
+# directly (core/memory own that), and importing it drags in grpc/protobuf
+# on cold start for nothing.
+
+# [Perf] orjson encodes broadcast payloads 3-10x faster than stdlib json.
+# Optional - state broadcasts fall back to stdlib when it's missing.
+try:
+    import orjson
+
+    def _ws_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    def _ws_dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
 
 load_dotenv()
 
@@ -46,7 +65,131 @@ class ChatRequest(BaseModel):
 
 
 # 记录最后互动时间
-active_connections: List[WebSocket] = []
+# [Perf] set, not list: disconnect churn made list.remove O(N) per drop
+# (quadratic across a reconnecting fleet); add/discard are O(1) here.
+active_connections: set = set()
+
+
+async def broadcast(payload_dict: dict):
+    """
+    [Perf] WebSocket fan-out: serialize the payload ONCE and send to all
+    clients concurrently - latency becomes the slowest client's RTT instead
+    of the sum, and dead sockets are pruned on the spot.
+    """
+    if not active_connections:
+        return
+    payload = _ws_dumps(payload_dict)
+    dead = []
+
+    async def _send_safe(conn):
+        try:
+            await conn.send_text(payload)
+        except Exception:
+            dead.append(conn)
+
+    await asyncio.gather(*[_send_safe(c) for c in list(active_connections)], return_exceptions=True)
+    for d in dead:
+        active_connections.discard(d)
+
+# [Perf] Dedicated pool for the pre-LLM context fetches. asyncio.to_thread
+# rides the default executor, which is shared with every other blocking call
+# in the process and self-throttles under concurrent chats.
+CTX_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="ctx")
+
+# [Perf] Emergency trigger scanner, compiled once. One C-level search instead
+# of 13 Python substring scans + a lower() allocation per message.
+EMERGENCY_KEYWORDS = ("stop", "don't", "quit", "shut", "off", "停", "不要", "闭嘴", "烦", "吵", "够了")
+_EMERGENCY_RE = re.compile("|".join(re.escape(k) for k in EMERGENCY_KEYWORDS), re.IGNORECASE)
+
+# [Perf] Optional Hyperscan backend: one block-mode DFA over all keywords,
+# O(bytes) per message regardless of how many triggers/locales get added.
+# The compiled-re scan above remains the fallback (same semantics).
+try:
+    import hyperscan
+
+    _EMERGENCY_DB = hyperscan.Database()
+    _EMERGENCY_DB.compile(
+        expressions=[re.escape(k).encode("utf-8") for k in EMERGENCY_KEYWORDS],
+        ids=list(range(len(EMERGENCY_KEYWORDS))),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8] * len(EMERGENCY_KEYWORDS),
+    )
+
+    def _is_emergency(text: str) -> bool:
+        matched = []
+
+        def _on_match(*_args):
+            matched.append(1)
+            return hyperscan.HS_SCAN_TERMINATED  # First hit is enough
+
+        _EMERGENCY_DB.scan(text.encode("utf-8"), match_event_handler=_on_match)
+        return bool(matched)
+except ImportError:
+    def _is_emergency(text: str) -> bool:
+        return _EMERGENCY_RE.search(text) is not None
+
+# [Perf] Zero-copy handoff to background analyzers. History is append-only
+# within a session, so (ref, length) pins a stable prefix without the O(N)
+# list(...) copy that every scheduled task used to make on the hot path.
+HistorySnapshot = namedtuple("HistorySnapshot", "data length")
+
+
+def _snapshot_history() -> HistorySnapshot:
+    return HistorySnapshot(app.state.chat_history, len(app.state.chat_history))
+
+
+# [Perf+Correctness] Monotonic clock for ALL interval/gap math (perf timers,
+# idle gates, interaction gaps) - immune to NTP wall-clock jumps. time.time()
+# stays only for values persisted to disk (timestamps, trigger_time).
+_now = time.monotonic
+
+
+# [Perf] Static wrapper around the care context, built once at import. The
+# rendered care list itself is memoized inside CareManager until a mutation
+# (or minute rollover) invalidates it.
+_CARE_PROMPT_TEMPLATE = """
+【待办关心事项 (Care List)】
+%s
+
+【植入逻辑 (Insertion Logic)】
+1. **时机 (Timing)**: 仅在事项状态为 **READY** 或 **OVERDUE** 时主动提及。对于未来的事项，除非用户问起日程，否则不要提及。
+2. **话题 (Topic)**: 如果当前话题非常严肃/悲伤，**推迟**提及任何非紧急事项，优先回应情绪。
+3. **自然 (Natural)**: 不要生硬转折。尝试将关心融入当前对话流。
+"""
+
+
+def _track_event(aw) -> asyncio.Task:
+    """
+    [Perf] One place for the schedule-and-track ritual: spawn the awaitable,
+    register it in scheduled_events, and drop it on completion with an O(1)
+    set.discard bound directly as the done-callback (no lambda, no 'in' scan).
+    """
+    task = asyncio.ensure_future(aw)
+    app.state.ctx.scheduled_events.add(task)
+    task.add_done_callback(app.state.ctx.scheduled_events.discard)
+    return task
+
+
+# [Perf] Memoized system-prompt composition. Profile and care context change
+# rarely relative to turn rate, so the common case is a dict hit on the
+# (profile, care_raw) pair instead of re-interpolating ~1KB of prompt text.
+@functools.lru_cache(maxsize=8)
+def _render_system(profile_context: str, care_raw: str) -> str:
+    # One %-substitution into the prebuilt wrapper; nothing when empty.
+    care_context = _CARE_PROMPT_TEMPLATE % care_raw if care_raw.strip() else ""
+    return f"{profile_context}\n\n{care_context}"
+
+
+# [Perf] Hot-path mutable state with guaranteed defaults, attached once as
+# app.state.ctx in startup_event. Replaces the scattered
+# getattr(app.state, "x", default) lookups (C-level fallback per call) with
+# slotted attribute access, and puts the state invariants in one place.
+@dataclass(slots=True)
+class ChatCtx:
+    scheduled_events: set = field(default_factory=set)  # pending asyncio.Task
+    message_count: int = 0
+    last_interaction: float = field(default_factory=time.monotonic)  # _now() clock
+    consecutive_proactive_count: int = 0
+    is_analyzing: bool = False
 
 
 
@@ -136,7 +279,13 @@ async def delete_message(msg_id: str):
     deleted_chat = original_len - len(app.state.chat_history)
     
     # 3. Persist
-    storage.save_session(app.state.current_session_id, app.state.chat_history)
+    # [Perf] Pass the in-memory logs: save_session would otherwise re-read
+    # and re-parse the whole session document just to preserve them.
+    storage.save_session(
+        app.state.current_session_id,
+        app.state.chat_history,
+        app.state.session_logs,
+    )
         
     return {
         "status": "success", 
@@ -172,13 +321,13 @@ async def load_session(session_id: str):
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    active_connections.append(websocket)
+    active_connections.add(websocket)
     try:
         while True:
             # 保持连接
             await websocket.receive_text()
     except:
-        active_connections.remove(websocket)
+        active_connections.discard(websocket)
 
 
 async def recursive_analyze_wrapper(session_id: str, profile_context: str, delay: int):
@@ -187,18 +336,15 @@ async def recursive_analyze_wrapper(session_id: str, profile_context: str, delay
 
 @app.post("/chat")
 async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks):
-    import traceback
-    from fastapi.responses import JSONResponse
-    
     # 【Event-Driven INTERRUPT】
     # 用户说话了！立刻取消所有 pending 的主动事件，清空计划列表
-    if hasattr(app.state, "scheduled_events"):
-        print(f"[Interrupt] User spoke. Cancelling {len(app.state.scheduled_events)} pending events.")
-        for future in app.state.scheduled_events:
+    if app.state.ctx.scheduled_events:
+        print(f"[Interrupt] User spoke. Cancelling {len(app.state.ctx.scheduled_events)} pending events.")
+        for future in app.state.ctx.scheduled_events:
             if not future.done():
                 future.cancel()
-        app.state.scheduled_events = [] # Clear tracking list
-        
+        app.state.ctx.scheduled_events = set() # Clear tracking set
+
         # [Persistence Check] Clear disk tasks too, to prevent Hydration resurrection!
         storage.clear_session_tasks(app.state.current_session_id)
 
@@ -207,28 +353,23 @@ async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks)
     # [Serialization Lock] Prevent "Barge-in" from killing the current stream.
     # User complained that "next sentence is cut off".
     # Solution: Wait for previous stream to finish (Serialize).
-    wait_start = time.time()
-    while getattr(app.state, "is_chat_processing", False):
-        await asyncio.sleep(0.1)
-        if time.time() - wait_start > 30: # Safety Timeout
-            print("[Chat] Wait Timeout - Forcing lock break.")
-            break
-
+    # [Perf] asyncio.Lock instead of a 100ms poll loop: the queued request
+    # wakes the instant the previous stream's finally releases, instead of
+    # up to 300 wakeups / +100ms latency per queued turn.
+    lock_acquired = True
+    try:
+        await asyncio.wait_for(app.state.chat_lock.acquire(), timeout=30) # Safety Timeout
+    except asyncio.TimeoutError:
+        print("[Chat] Wait Timeout - Forcing lock break.")
+        lock_acquired = False  # Proceed unlocked; the stuck holder keeps its claim
 
-    # [State] Idle (Reset on chat start to be safe, but actually we want Listening?)
-    # No, keep previous state. But after chat processing, we should set to Idle.
-    
-    # 【原子锁】上锁：在处理用户消息期间，禁止主动逻辑插嘴
-    app.state.is_chat_processing = True
-    start_time = time.time()
-    
     try:
         # 重置主动搭讪计数器
-        app.state.last_interaction = time.time()
-        app.state.consecutive_proactive_count = 0
-        
+        app.state.ctx.last_interaction = _now()
+        app.state.ctx.consecutive_proactive_count = 0
+
         # 1. 记录用户输入
-        t1 = time.time()
+        t1 = _now()
         
         # [Identity] Ensure Message ID exists for linking
         user_msg_id = request.id or str(uuid.uuid4())
@@ -239,87 +380,72 @@ async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks)
             request.message, 
             metadata={"role": "user", "source_id": user_msg_id}
         ))
-        print(f"[Perf] Memory Add: {(time.time() - t1):.3f}s")
+        print(f"[Perf] Memory Add: {(_now() - t1):.3f}s")
         
         # [State] Memory Recall
-        for conn in active_connections:
-            try: await conn.send_json({"type": "state", "phase": "memory"})
-            except: pass
+        await broadcast({"type": "state", "phase": "memory"})
 
         # 2. 并行检索上下文 (Parallel Context Loading)
-        # [Optimization] Run expensive fetches in parallel threads to reduce latency
-        t2 = time.time()
-        
-        async def fetch_memory():
-            try: return memory.query_memory(request.message)
-            except Exception as e:
-                print(f"[Chat] Memory Query Warning: {e}")
-                return ""
-                
-        async def fetch_profile():
-            return profile_manager.get_profile_context()
-            
-        async def fetch_care():
-            return care_manager.get_context_string()
-
-        # Run all three concurrently
-        results = await asyncio.gather(
-            asyncio.to_thread(memory.query_memory, request.message),
-            asyncio.to_thread(profile_manager.get_profile_context),
-            asyncio.to_thread(care_manager.get_context_string)
+        # [Optimization] Run expensive fetches in parallel on the dedicated
+        # CTX_POOL - isolated from the default executor's shared queue.
+        t2 = _now()
+
+        loop = asyncio.get_running_loop()
+        memory_context, profile_context, care_raw = await asyncio.gather(
+            loop.run_in_executor(CTX_POOL, memory.query_memory, request.message),
+            loop.run_in_executor(CTX_POOL, profile_manager.get_profile_context),
+            loop.run_in_executor(CTX_POOL, care_manager.get_context_string)
         )
-        
-        memory_context, profile_context, care_raw = results
-        print(f"[Perf] Parallel Context Load: {(time.time() - t2):.3f}s")
-
-        if care_raw.strip():
-            care_context = f"""
-【待办关心事项 (Care List)】
-{care_raw}
-
-【植入逻辑 (Insertion Logic)】
-1. **时机 (Timing)**: 仅在事项状态为 **READY** 或 **OVERDUE** 时主动提及。对于未来的事项，除非用户问起日程，否则不要提及。
-2. **话题 (Topic)**: 如果当前话题非常严肃/悲伤，**推迟**提及任何非紧急事项，优先回应情绪。
-3. **自然 (Natural)**: 不要生硬转折。尝试将关心融入当前对话流。
-"""
-        else:
-            care_context = ""
+        print(f"[Perf] Parallel Context Load: {(_now() - t2):.3f}s")
 
-        dynamic_system_prompt = f"{profile_context}\n\n{care_context}"
+        # [Perf] Memoized composition: profile + care list are stable across
+        # most consecutive turns, so repeat turns reuse the rendered string.
+        dynamic_system_prompt = _render_system(profile_context, care_raw)
         
         # [State] Generating (Thinking)
-        for conn in active_connections:
-            try: await conn.send_json({"type": "state", "phase": "thinking"})
-            except: pass
+        await broadcast({"type": "state", "phase": "thinking"})
 
-        t4 = time.time()
-        t4 = time.time()
+        t4 = _now()
         
         # 4. 流式生成回复 (Streaming Response)
         async def response_streamer():
-             full_response = ""
+             # [Perf] Accumulate chunks in a list and join once: += on a str
+             # that is also yielded re-copies the whole response per chunk.
+             chunks = []
+             # [Durability] Persist the user turn BEFORE the LLM stream starts.
+             # Even if Gemini dies mid-stream, the user's message survives on
+             # disk (O(1) append, not a full-session rewrite).
+             user_entry = {
+                 "id": user_msg_id, # [Link] Store ID in history
+                 "role": "user",
+                 "parts": [request.message],
+                 "timestamp": time.time()
+             }
+             storage.append_history_entry(app.state.current_session_id, user_entry)
              try:
+                 # [Debug] Verify Context Injection - printed once BEFORE the
+                 # stream (it doesn't depend on chunks), so the hot loop below
+                 # carries no per-chunk branch. Opt-in via DEBUG_CONTEXT.
+                 if os.getenv("DEBUG_CONTEXT"):
+                     print(f"[Chat] Debug Context Length: Mem={len(memory_context)}, Profile={len(profile_context)}")
+                     if len(memory_context) > 0: print(f"[Chat] Memory Preview: {memory_context[:100]}...")
                  try:
                     async for chunk in gemini.stream_chat(
-                        request.message, 
-                        history=app.state.chat_history, 
-                        memory_context=memory_context, 
+                        request.message,
+                        history=app.state.chat_history,
+                        memory_context=memory_context,
                         system_instruction=dynamic_system_prompt
                     ):
-                        # [Debug] Verify Context Injection
-                        if not full_response:
-                            print(f"[Chat] Debug Context Length: Mem={len(memory_context)}, Profile={len(profile_context)}")
-                            if len(memory_context) > 0: print(f"[Chat] Memory Preview: {memory_context[:100]}...")
-                        
-                        full_response += chunk
+                        chunks.append(chunk)
                         yield chunk
                  except Exception as e:
                      print(f"[Streaming] Error: {e}")
                      yield f"[System Error: {str(e)}]"
                      # Continue to finally block
                      
-                 print(f"[Perf] Gemini Stream Complete: {(time.time() - t4):.3f}s")
+                 print(f"[Perf] Gemini Stream Complete: {(_now() - t4):.3f}s")
 
+                 full_response = "".join(chunks)
                  # --- Post-Stream Side Effects (Previously Sync) ---
                  if full_response: # Only save if we got something
                      # 【关键修复】显式追加历史记录
@@ -327,55 +453,49 @@ async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks)
                      if not isinstance(app.state.chat_history, list):
                          print(f"[Chat] CRITICAL: chat_history is {type(app.state.chat_history)}. Resetting.")
                          app.state.chat_history = []
-                         
-                     timestamp_now = time.time()
-                     app.state.chat_history.append({
-                         "id": user_msg_id, # [Link] Store ID in history
-                         "role": "user", 
-                         "parts": [request.message],
-                         "timestamp": timestamp_now 
-                     })
-                     
-                     app.state.chat_history.append({
+
+                     model_entry = {
                          "id": str(uuid.uuid4()), # [Link] Give AI ID too
-                         "role": "model", 
+                         "role": "model",
                          "parts": [full_response],
-                         "timestamp": time.time() 
-                     })
-                     storage.save_session(app.state.current_session_id, app.state.chat_history)
-                 
+                         "timestamp": time.time()
+                     }
+                     app.state.chat_history.append(user_entry)
+                     app.state.chat_history.append(model_entry)
+                     # [Perf] The user entry is already on disk (pre-stream);
+                     # only the assistant turn needs persisting here.
+                     storage.append_history_entry(app.state.current_session_id, model_entry)
+
                      # 7. 后台任务
-                    app.state.message_count = getattr(app.state, "message_count", 0) + 1
-                    
-                    # [Logic] Regular Schedule
-                    should_analyze = (app.state.message_count <= 2) or (app.state.message_count % 10 == 0)
-                    
-                    # [Logic] Emergency Trigger (Anti-Paranoia)
-                    # If user says "Stop", update profile IMMEDIATELY to apply the Falsification Principle.
-                    emergency_keywords = ["stop", "don't", "quit", "shut", "off", "停", "不要", "闭嘴", "烦", "吵", "够了"]
-                    if any(k in request.message.lower() for k in emergency_keywords):
-                        print(f"[Profile] Emergency Trigger detected in: '{request.message}'")
-                        should_analyze = True
-
-                    if should_analyze:
-                        background_tasks.add_task(run_profile_analysis, list(app.state.chat_history))
-                 
-                     # [CareSystem + Decision Chain] 
+                     app.state.ctx.message_count += 1
+
+                     # [Logic] Regular Schedule
+                     should_analyze = (app.state.ctx.message_count <= 2) or (app.state.ctx.message_count % 10 == 0)
+
+                     # [Logic] Emergency Trigger (Anti-Paranoia)
+                     # If user says "Stop", update profile IMMEDIATELY to apply the Falsification Principle.
+                     if _is_emergency(request.message):
+                         print(f"[Profile] Emergency Trigger detected in: '{request.message}'")
+                         should_analyze = True
+
+                     if should_analyze:
+                         background_tasks.add_task(run_profile_analysis, _snapshot_history())
+
+                     # [CareSystem + Decision Chain]
                      async def shielded_care_sequence(prompt_str):
                          try:
-                             # 1. Update Care List
-                             await run_care_update(list(app.state.chat_history))
-                            
+                             # 1. Update Care List (queued - the single worker
+                             # coalesces bursts into one analysis)
+                             request_care_update(_snapshot_history())
+
                              # 2. Conditionally Schedule
-                             current_gap = time.time() - app.state.last_interaction
-                             if current_gap < 0.5: 
+                             current_gap = _now() - app.state.ctx.last_interaction
+                             if current_gap < 0.5:
                                  print(f"[Sequence] User active (gap {current_gap:.2f}s), skipping proactive schedule.")
                                  return
 
-                             sche_task = asyncio.create_task(schedule_next_event(app.state.current_session_id, prompt_str, 1))
-                             app.state.scheduled_events.append(sche_task)
-                             sche_task.add_done_callback(lambda f: app.state.scheduled_events.remove(f) if f in app.state.scheduled_events else None)
-                            
+                             _track_event(schedule_next_event(app.state.current_session_id, prompt_str, 1))
+
                          except Exception as e:
                              print(f"[Sequence] Error: {e}")
 
@@ -384,16 +504,16 @@ async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks)
              finally:
                  # [Unlock] Serialization Complete - ALWAYS RUNS
                  print("[Chat] Releasing Lock.")
-                 app.state.is_chat_processing = False
-                 for conn in active_connections:
-                     try: await conn.send_json({"type": "state", "phase": "idle"})
-                     except: pass
+                 if lock_acquired:
+                     app.state.chat_lock.release()
+                 await broadcast({"type": "state", "phase": "idle"})
 
         return StreamingResponse(response_streamer(), media_type="text/plain")
 
     except Exception as e:
         error_msg = str(e)
-        app.state.is_chat_processing = False # Unlock on error
+        if lock_acquired:
+            app.state.chat_lock.release() # Unlock on error (stream never started)
         if "429" in error_msg or "quota" in error_msg.lower():
             print(f"[Chat] Quota Exceeded: {error_msg}")
             return JSONResponse(status_code=429, content={"detail": "Quota Exceeded"})
@@ -406,11 +526,12 @@ async def chat_endpoint(request: ChatRequest, background_tasks: BackgroundTasks)
 
 async def run_profile_analysis(history):
     print("[Profile] Analyzing user persona...")
+    # Unwrap the snapshot off the hot path (one tail slice, not per-turn copies)
+    if isinstance(history, HistorySnapshot):
+        history = history.data[:history.length]
     
     # [State] Profile Update
-    for conn in active_connections:
-        try: await conn.send_json({"type": "state", "phase": "profile"})
-        except: pass
+    await broadcast({"type": "state", "phase": "profile"})
 
 
         
@@ -423,8 +544,7 @@ async def run_profile_analysis(history):
     # Actually, don't force idle here, as it might happen in parallel? 
     # Profile usually happens AFTER chat. So let's briefy flash it then idle.
     await asyncio.sleep(1)
-    for conn in active_connections:
-        await conn.send_json({"type": "state", "phase": "idle"})
+    await broadcast({"type": "state", "phase": "idle"})
 
 async def run_care_update(history):
     """
@@ -432,11 +552,12 @@ async def run_care_update(history):
     """
     try:
         print("[CareSystem] Triggering analysis...")
-        current_list = care_manager.care_list["items"]
-        # Use a copy of history to avoid race conditions
-        history_copy = [h for h in history]
-        
-        result = await gemini.analyze_care_needs(history_copy, current_list)
+        if isinstance(history, HistorySnapshot):
+            history = history.data[:history.length]
+        current_list = care_manager.get_all_items()
+        # [Perf] No defensive copy: analyze_care_needs only reads the last
+        # few turns, and the snapshot slice above already pins the window.
+        result = await gemini.analyze_care_needs(history, current_list)
         
         if result and "actions" in result:
             actions = result["actions"]
@@ -461,6 +582,33 @@ async def run_care_update(history):
     except Exception as e:
         print(f"[CareSystem] Update failed: {e}")
 
+def request_care_update(history_snapshot):
+    """
+    [Perf] Enqueue instead of spawn. A full queue means an update is already
+    pending - drop this one, the pending run sees newer state anyway.
+    """
+    try:
+        app.state.care_queue.put_nowait(history_snapshot)
+    except asyncio.QueueFull:
+        print("[CareSystem] Update already pending, coalescing.")
+
+async def _care_worker():
+    """
+    [Perf] Single consumer for care analyses. Chat turns and proactive tasks
+    used to each fire their own run_care_update via create_task, so two
+    overlapping turns could run two concurrent LLM analyses whose results
+    raced into care_manager. One worker = at most one analysis in flight;
+    queued requests coalesce down to the newest snapshot.
+    """
+    while True:
+        snapshot = await app.state.care_queue.get()
+        while not app.state.care_queue.empty():
+            snapshot = app.state.care_queue.get_nowait()
+        try:
+            await run_care_update(snapshot)
+        except Exception as e:
+            print(f"[CareSystem] Worker error: {e}")
+
 async def task_executor(thought_data: dict):
     """
     [Event-Driven] Executes a scheduled logic from memory.
@@ -499,12 +647,11 @@ async def task_executor(thought_data: dict):
 
         if response_text:
             print(f"[Scheduler] Generated: {response_text}")
-            for conn in active_connections:
-                await conn.send_json({"type": "proactive", "content": response_text, "thought": task_content})
+            await broadcast({"type": "proactive", "content": response_text, "thought": task_content})
             
             # [Apple Integration] Smart Notification
             # Rule: Only notify if user has been away for > 2 minutes (120s)
-            idle_time = time.time() - getattr(app.state, "last_interaction", 0)
+            idle_time = _now() - app.state.ctx.last_interaction
             if idle_time > 120:
                 from apple_client import send_to_reminders
                 # Run sync in thread to avoid blocking main loop
@@ -515,21 +662,23 @@ async def task_executor(thought_data: dict):
             # [Disinfect] Don't add proactive message to long-term memory to avoid pattern infection
             # memory.add_memory(response_text, metadata={"role": "assistant", "type": "task"})
             
-            app.state.chat_history.append({
-                "role": "model", 
+            proactive_entry = {
+                "role": "model",
                 "parts": [response_text],
                 "timestamp": time.time()
-            })
-            storage.save_session(app.state.current_session_id, app.state.chat_history)
+            }
+            app.state.chat_history.append(proactive_entry)
+            # [Perf] O(1) append instead of rewriting the whole session
+            storage.append_history_entry(app.state.current_session_id, proactive_entry)
             
             # [CareSystem] Loop Closure: Analyze proactive interaction to update list
             # (e.g. Mark "Reminder" as done if we just said it)
-            asyncio.create_task(run_care_update(list(app.state.chat_history)))
+            request_care_update(_snapshot_history())
 
         # memory.add_memory(response_text, metadata={"role": "assistant", "type": "proactive_task"})
         
         # Increment Proactive Counter
-        app.state.consecutive_proactive_count = getattr(app.state, "consecutive_proactive_count", 0) + 1
+        app.state.ctx.consecutive_proactive_count += 1
         
         # [Fix] Fetch fresh profile context for the Next Move analysis
         # Otherwise the AI forgets "Who it is" and "Who user is" in the next loop.
@@ -549,23 +698,35 @@ async def schedule_next_event(session_id: str, profile_context: str, delay: int
     Decides the SINGLE next move after an interaction.
     Uses a simple lock to prevent parallel analysis race conditions.
     """
-    if getattr(app.state, "is_analyzing", False):
+    if app.state.ctx.is_analyzing:
         return # Skip if already thinking
     
-    app.state.is_analyzing = True
+    app.state.ctx.is_analyzing = True
     try:
         await asyncio.sleep(delay)
     
         if app.state.current_session_id != session_id:
             return
 
-        current_count = getattr(app.state, "consecutive_proactive_count", 0)
+        current_count = app.state.ctx.consecutive_proactive_count
         print(f"[Scheduler] Thinking about next move... (Count: {current_count})")
         
         # [CareSystem] Inject context for decision making
         care_context = care_manager.get_context_string()
         
-        result = await gemini.evaluate_next_move(app.state.chat_history, profile_context, care_context=care_context, consecutive_count=current_count)
+        # [Perf] Reuse the chat turn's compacted context (take-once) instead
+        # of re-running the O(n) detox pass; the only delta since the stream
+        # is the model reply, appended here. Falls back to a fresh compaction
+        # when no stream ran this turn (e.g. proactive follow-up chains).
+        compacted = gemini.last_compacted
+        gemini.last_compacted = None
+        if compacted is not None and app.state.chat_history:
+            tail = app.state.chat_history[-1]
+            if tail.get("role") == "model":
+                tail_parts = tail.get("parts") or [""]
+                compacted = compacted + [{"role": "model", "parts": [tail_parts[0]]}]
+
+        result = await gemini.evaluate_next_move(app.state.chat_history, profile_context, care_context=care_context, consecutive_count=current_count, compacted=compacted)
         action = result.get("action")
         print(f"[Scheduler] Decision: {result}")
         
@@ -579,24 +740,18 @@ async def schedule_next_event(session_id: str, profile_context: str, delay: int
         }
         
         # [Persistence] Save Thought to Session Logs
-        app.state.session_logs.append({
+        log_entry = {
             "type": "thought",
             "content": model_thought, # JSON object
             "timestamp": time.strftime("%H:%M:%S")
-        })
-        storage.save_session(app.state.current_session_id, app.state.chat_history, app.state.session_logs)
+        }
+        app.state.session_logs.append(log_entry)
+        # [Perf] O(1) log append - the full document rewrite here also
+        # re-serialized the entire chat history for every thought.
+        storage.append_log_entry(app.state.current_session_id, log_entry)
 
-        # Broadcast Thought
         # Broadcast Thought (Safe Mode)
-        for conn in list(active_connections): # Copy list to avoid modification errors during iteration
-            try:
-                await conn.send_json({"type": "thought", "content": model_thought})
-            except Exception as e:
-                print(f"[Scheduler] Broadcast Error: {e}")
-                # Optional: Remove dead connection right here?
-                # Better to let the receive loop handle removal, but we can't wait.
-                # If we remove it here, we might race with the receive loop.
-                # Just ignore failure is safest.
+        await broadcast({"type": "thought", "content": model_thought})
 
         if action == "WAIT" or action == "WAIT_FOR_USER":
             print(f"[Scheduler] 💤 Decided to wait. Reason: {result.get('thought', 'No thought')}")
@@ -649,23 +804,23 @@ async def schedule_next_event(session_id: str, profile_context: str, delay: int
                      
                      if app.state.current_session_id == session_id: # Strict Isolation
                          # [Persistence] Remove task from disk before executing
-                         storage.remove_scheduled_task(task_id)
+                         storage.remove_scheduled_task(task_id, session_id)
                          # [Action] Execute the thought
                          # We need to find task_executor. It must be defined in global scope or passed in.
                          # Since hydrate calls it, it must be global.
-                         await task_executor(model_thought.copy())
+                         # [Perf] Pass the thought as-is; task_executor only
+                         # reads it, so the per-event dict copy bought nothing.
+                         await task_executor(model_thought)
                          
                  except asyncio.CancelledError:
                      pass
                  except Exception as e:
                      print(f"[Scheduler] Trigger Error: {e}")
                      
-             future = asyncio.create_task(memory_trigger())
-             app.state.scheduled_events.append(future)
-             future.add_done_callback(lambda f: app.state.scheduled_events.remove(f) if f in app.state.scheduled_events else None)
+             _track_event(memory_trigger())
 
     finally:
-        app.state.is_analyzing = False
+        app.state.ctx.is_analyzing = False
 
 def hydrate_session_tasks(session_id: str):
     """
@@ -675,33 +830,37 @@ def hydrate_session_tasks(session_id: str):
     tasks = storage.get_scheduled_tasks(session_id)
     now = time.time()
     count = 0
-    
-    for task in tasks:
-        trigger_time = task.get("trigger_time", now)
-        delay = trigger_time - now
-        task_id = task.get("id")
-        thought = task.get("thought", {})
-        
-        # Define re-hydrated trigger
-        async def rehydrated_trigger(d, t_id, th):
-            try:
-                if d > 0:
-                    print(f"[Hydration] Resuming task {t_id} (Wait {int(d)}s)")
-                    await asyncio.sleep(d)
-                else:
-                    print(f"[Hydration] Catch-up task {t_id} (Overdue by {int(-d)}s)")
-                
-                if app.state.current_session_id == session_id:
-                     storage.remove_scheduled_task(t_id)
-                     await task_executor(th)
-            except Exception as e:
-                print(f"[Hydration] Error executing task {t_id}: {e}")
-
-        future = asyncio.create_task(rehydrated_trigger(delay, task_id, thought))
-        app.state.scheduled_events.append(future)
-        future.add_done_callback(lambda f: app.state.scheduled_events.remove(f) if f in app.state.scheduled_events else None)
+
+    # Define re-hydrated trigger
+    async def rehydrated_trigger(d, t_id, th):
+        try:
+            if d > 0:
+                print(f"[Hydration] Resuming task {t_id} (Wait {int(d)}s)")
+                await asyncio.sleep(d)
+            else:
+                print(f"[Hydration] Catch-up task {t_id} (Overdue by {int(-d)}s)")
+
+            if app.state.current_session_id == session_id:
+                 storage.remove_scheduled_task(t_id, session_id)
+                 await task_executor(th)
+        except Exception as e:
+            print(f"[Hydration] Error executing task {t_id}: {e}")
+
+    # [Perf] Schedule in trigger order; overdue catch-ups get ONE batch task
+    # (single gather) instead of one task + done-callback apiece.
+    overdue = []
+    for task in sorted(tasks, key=lambda t: t.get("trigger_time", now)):
+        delay = task.get("trigger_time", now) - now
+        trigger = rehydrated_trigger(delay, task.get("id"), task.get("thought", {}))
+        if delay > 0:
+            _track_event(trigger)
+        else:
+            overdue.append(trigger)
         count += 1
-        
+
+    if overdue:
+        _track_event(asyncio.gather(*overdue, return_exceptions=True))
+
     if count > 0:
         print(f"[Hydration] Restored {count} pending tasks.")
 
@@ -709,13 +868,17 @@ def hydrate_session_tasks(session_id: str):
 async def startup_event():
     # 初始化全局状态
     app.state.interrupt_event = asyncio.Event()
-    app.state.is_chat_processing = False
-    app.state.last_interaction = time.time()
-    app.state.consecutive_proactive_count = 0
-    
-    # Event Driven State
-    app.state.scheduled_events = [] # List of asyncio.Task
-    
+    # 【原子锁】处理用户消息期间，禁止主动逻辑插嘴 (held across the stream)
+    app.state.chat_lock = asyncio.Lock()
+    # [Perf] Typed hot-path state (counters, flags, pending-event set) -
+    # see ChatCtx. scheduled_events is a set so done-callbacks drop finished
+    # tasks with an O(1) discard instead of an O(N) list remove.
+    app.state.ctx = ChatCtx()
+
+    # [CareSystem] Coalescing queue + single worker (see _care_worker)
+    app.state.care_queue = asyncio.Queue(maxsize=1)
+    asyncio.create_task(_care_worker())
+
     print("[Startup] System initialized (Active Protocols DELETED).")
     print("[Startup] Cleanup complete.")
 
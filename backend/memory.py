@@ -1,12 +1,103 @@
+import atexit
+import base64
+import functools
 import os
 import json
+import hashlib
+import heapq
+import threading
 import time
+from collections import OrderedDict
 from typing import Dict, List, Any
 import google.generativeai as genai
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# [Perf] orjson decodes/encodes the embedding-heavy memory records through a
+# C serializer, ~3-6x faster than stdlib json. Optional, stdlib fallback.
+try:
+    import orjson
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+
+    _loads = json.loads
+
+# [Perf] Optional NumPy acceleration: similarity math drops into BLAS SIMD
+# kernels instead of ~2000 Python bytecodes per 768-d comparison. The pure
+# Python math stays as the fallback when NumPy is missing.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# [Perf] Optional SIMD similarity kernel: simsimd auto-dispatches to
+# AVX-512/NEON/SVE and beats a BLAS GEMV on short single-query batches
+# where call overhead dominates. Falls back to the NumPy matmul.
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+# [Perf] Optional ANN acceleration. With FAISS installed, queries go through
+# an inner-product index over L2-normalized vectors (== cosine ranking)
+# instead of an O(N*d) scan. Falls back to the scan if missing.
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# [Perf] Optional Numba: a @njit(parallel=True) dot-product scan spreads the
+# row loop across cores, unlike the (typically single-threaded) GEMV it
+# replaces. Slots between simsimd and plain matmul in the backend ladder.
+try:
+    from numba import njit, prange
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _numba_scan(matrix, q):
+        n = matrix.shape[0]
+        out = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            s = 0.0
+            for j in range(matrix.shape[1]):
+                s += matrix[i, j] * q[j]
+            out[i] = s
+        return out
+except ImportError:
+    _numba_scan = None
+
+# [Perf] Query-result cache: repeat queries (retries, quick back-and-forth)
+# skip both the embed round-trip and the search.
+_QUERY_CACHE_MAX = 512
+_QUERY_CACHE_TTL = 300.0  # seconds
+
+# [Perf] Semantic cache: a paraphrased query whose embedding lands within
+# this cosine of a previous one reuses that result - skips the ranking scan
+# for the "same question, different words" pattern chat UX produces.
+_SEMANTIC_CACHE_MAX = 128
+_SEMANTIC_CACHE_THRESHOLD = 0.95
+
+# [Perf] Embedding memo: identical text + task_type never pays the ~100ms
+# API round-trip twice. Tuples keep the cached value hashable/immutable;
+# failures raise and are NOT cached, so transient errors retry naturally.
+@functools.lru_cache(maxsize=2048)
+def _embed_cached(text: str, task_type: str, title: str = None) -> tuple:
+    kwargs = {
+        "model": "models/text-embedding-004",
+        "content": text,
+        "task_type": task_type,
+    }
+    if title:
+        kwargs["title"] = title
+    return tuple(genai.embed_content(**kwargs)["embedding"])
+
+
 # [Memory System V2: JSON + Gemini Embedding]
 # Why? Because Local Qdrant/Chroma persistence proved flaky in this environment.
 # This system stores memories as a simple JSON list [text, embedding, timestamp].
@@ -23,7 +114,11 @@ class MemoryManager:
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
 
-        self.memory_file = os.path.join(self.data_dir, "memories.json")
+        # [Perf] Append-only ndjson log: adding one memory writes one line
+        # (O(d)) instead of re-serializing every stored embedding (O(N*d)).
+        # Legacy memories.json stores migrate once on first load.
+        self.memory_file = os.path.join(self.data_dir, "memories.jsonl")
+        self._legacy_file = os.path.join(self.data_dir, "memories.json")
         
         self.api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
         if not self.api_key:
@@ -32,39 +127,376 @@ class MemoryManager:
             genai.configure(api_key=self.api_key)
 
         self.memories = [] # List of {"text": str, "embedding": List[float], "timestamp": float}
+        # [Perf] digest -> (expires_at, context_string); cleared on mutation
+        self._query_cache: OrderedDict = OrderedDict()
+        # [Perf] (unit query vector, top_k, formatted result) ring buffer;
+        # cleared on mutation like the exact-match cache above
+        self._semantic_cache: List[tuple] = []
+        # [Perf] FAISS index + row->memory position map, rebuilt lazily
+        self._index = None
+        self._index_ids: List[int] = []
+        # [Perf] Dense (N, d) float32 matrix of unit-norm embeddings for the
+        # no-FAISS path: one BLAS GEMV per query instead of N Python calls.
+        self._matrix = None
+        self._matrix_n = 0  # valid rows; the backing array holds spare capacity
+        self._matrix_ids: List[int] = []
+        # [Perf] source_id -> positions; rebuilt in load_memories
+        self._by_source: Dict[str, List[int]] = {}
+        # [Concurrency] The deferred snapshot runs on a Timer thread while
+        # adds/deletes mutate self.memories on the event-loop thread; one
+        # reentrant lock covers the mutators and both write paths so a 'w'
+        # rewrite can't interleave with an 'a' append (or duplicate its line).
+        self._lock = threading.RLock()
+        # [Perf] Write coalescing for the snapshot rewrite (deletion paths):
+        # a burst of deletes triggers one deferred save_memories, not one
+        # full-file rewrite each. Adds stay synchronous O(1) appends.
+        self._dirty = False
+        self._flush_interval = 0.5
+        self._flush_timer: threading.Timer = None
+        atexit.register(self.flush)
         self.load_memories()
 
+    @staticmethod
+    def _quantize(vector) -> tuple:
+        """
+        [Perf] Symmetric per-vector int8 quantization. One 768-d embedding
+        shrinks from ~10KB of JSON floats to ~1KB of base64 - 4x less RAM
+        and disk bandwidth per memory. scale recovers v ~= q * scale.
+        """
+        v = np.asarray(vector, dtype=np.float32)
+        amax = float(np.max(np.abs(v))) if v.size else 0.0
+        scale = amax / 127.0 if amax else 1.0
+        q = np.clip(np.round(v / scale), -127, 127).astype(np.int8)
+        return base64.b64encode(q.tobytes()).decode("ascii"), scale
+
+    @staticmethod
+    def _attach_vec(mem: Dict):
+        """
+        [Perf] Cache the embedding as a UNIT-NORM float32 ndarray on the dict
+        (underscore keys are stripped before persisting). Normalizing once
+        here collapses cosine similarity to a plain dot product - no
+        per-comparison magnitude passes on the hot path. Accepts both the
+        quantized format (q/scale) and legacy raw float lists.
+        """
+        if np is None or "_vec" in mem:
+            return
+        if mem.get("q"):
+            raw = np.frombuffer(base64.b64decode(mem["q"]), dtype=np.int8)
+            vec = raw.astype(np.float32) * mem.get("scale", 1.0)
+        elif mem.get("embedding"):
+            vec = np.asarray(mem["embedding"], dtype=np.float32)
+        else:
+            return
+        norm = np.linalg.norm(vec)
+        if norm:
+            vec = vec / norm
+        mem["_vec"] = vec
+
     def load_memories(self):
+        self.memories = []
         if os.path.exists(self.memory_file):
             try:
                 with open(self.memory_file, 'r', encoding='utf-8') as f:
-                    self.memories = json.load(f)
+                    for line in f:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            self.memories.append(_loads(line))
+                        except Exception:
+                            pass  # Skip corrupt tail (e.g. crash mid-append)
                 print(f"[Memory] Loaded {len(self.memories)} memories from disk.")
             except Exception as e:
                 print(f"[Memory] Failed to load memories: {e}")
                 self.memories = []
+        elif os.path.exists(self._legacy_file):
+            # One-shot legacy JSON -> ndjson migration (old file kept as .bak)
+            try:
+                with open(self._legacy_file, 'r', encoding='utf-8') as f:
+                    self.memories = _loads(f.read())
+                self.save_memories()
+                os.replace(self._legacy_file, self._legacy_file + ".bak")
+                print(f"[Memory] Migrated {len(self.memories)} memories to ndjson.")
+            except Exception as e:
+                print(f"[Memory] Migration failed: {e}")
+                self.memories = []
         else:
             print("[Memory] No existing memory file found. Starting fresh.")
-            self.memories = []
+        for mem in self.memories:
+            self._attach_vec(mem)
+        self._rebuild_source_index()
+
+    def _rebuild_source_index(self):
+        """[Perf] source_id -> memory positions, so per-message deletes are
+        O(k) lookups instead of an O(N) predicate walk."""
+        self._by_source = {}
+        for pos, mem in enumerate(self.memories):
+            sid = mem.get("metadata", {}).get("source_id")
+            if sid:
+                self._by_source.setdefault(sid, []).append(pos)
+
+    def _delete_positions(self, positions: List[int]) -> int:
+        """
+        Remove the given memory positions via swap-with-last: each removal
+        is O(1) and no surviving entry is copied. The source index entries
+        of moved rows are patched in place.
+        """
+        for pos in sorted(positions, reverse=True):
+            last = len(self.memories) - 1
+            if pos != last:
+                moved = self.memories[last]
+                self.memories[pos] = moved
+                m_sid = moved.get("metadata", {}).get("source_id")
+                lst = self._by_source.get(m_sid) if m_sid else None
+                if lst is not None:
+                    lst[lst.index(last)] = pos
+            self.memories.pop()
+        return len(positions)
+
+    @staticmethod
+    def _clean(mem: Dict) -> Dict:
+        """Strip cached runtime-only keys (ndarrays are not JSON-safe)."""
+        return {k: v for k, v in mem.items() if not k.startswith("_")}
 
     def save_memories(self):
-        try:
-            with open(self.memory_file, 'w', encoding='utf-8') as f:
-                json.dump(self.memories, f, ensure_ascii=False, indent=2)
-            print("[Memory] Persisted to disk.")
-        except Exception as e:
-            print(f"[Memory] Save failed: {e}")
+        """Full rewrite (snapshot). Deletion paths use this; adds append."""
+        with self._lock:
+            try:
+                with open(self.memory_file, 'w', encoding='utf-8') as f:
+                    for mem in self.memories:
+                        f.write(_dumps(self._clean(mem)) + "\n")
+                # Cleared only after a successful rewrite - a failed save
+                # stays dirty and retries on the next flush.
+                self._dirty = False
+                print("[Memory] Persisted to disk.")
+            except Exception as e:
+                print(f"[Memory] Save failed: {e}")
+
+    def _mark_dirty(self):
+        """Schedule one deferred save_memories (cancel-and-reschedule)."""
+        with self._lock:
+            self._dirty = True
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(self._flush_interval, self.save_memories)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """Force any pending coalesced snapshot to disk immediately."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._dirty:
+                self.save_memories()
+
+    def _append_memory(self, mem: Dict):
+        """[Perf] O(1) log append of one new memory - no full-file rewrite."""
+        with self._lock:
+            try:
+                with open(self.memory_file, 'a', encoding='utf-8') as f:
+                    f.write(_dumps(self._clean(mem)) + "\n")
+            except Exception as e:
+                print(f"[Memory] Append failed: {e}")
+
+    def _invalidate_caches(self):
+        """Any mutation makes cached results, the matrix and the index stale."""
+        self._query_cache.clear()
+        self._semantic_cache.clear()
+        self._index = None
+        self._index_ids = []
+        self._matrix = None
+        self._matrix_n = 0
+        self._matrix_ids = []
+
+    def _ensure_index(self):
+        """
+        [Perf] Build the FAISS index over stored vectors, lazily after
+        mutations. Small corpora get an exact IndexFlatIP (SIMD scan);
+        large ones get HNSW for O(log N) search. Stored vectors are already
+        unit-norm (see _attach_vec) so inner product == cosine similarity.
+        """
+        if faiss is None or not self.memories:
+            return None
+        if self._index is not None:
+            return self._index
+
+        ids, vecs = [], []
+        for pos, mem in enumerate(self.memories):
+            vec = mem.get("_vec")
+            if vec is not None and len(vec):
+                ids.append(pos)
+                vecs.append(vec)
+        if not vecs:
+            return None
+
+        mat = np.vstack(vecs)
+        dim = mat.shape[1]
+        if len(vecs) > 10000:
+            index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexFlatIP(dim)
+        index.add(mat)
+        self._index = index
+        self._index_ids = ids
+        return index
+
+    def _ensure_matrix(self):
+        """
+        [Perf] Stack stored embeddings into one (N, d) float32 matrix, lazily
+        after mutations. Rows are already unit-norm (see _attach_vec), so a
+        query costs a single GEMV plus an argpartition instead of N
+        interpreted cosine calls + a full sort.
+
+        The backing array is preallocated with 2x headroom so adds write one
+        row in place (_matrix_append) instead of re-stacking N rows; only
+        the first _matrix_n rows are valid and returned.
+        """
+        if np is None or not self.memories:
+            return None
+        if self._matrix is not None and self._matrix_n:
+            return self._matrix[:self._matrix_n]
+
+        ids, vecs = [], []
+        for pos, mem in enumerate(self.memories):
+            vec = mem.get("_vec")
+            if vec is not None and len(vec):
+                ids.append(pos)
+                vecs.append(vec)
+        if not vecs:
+            return None
+
+        n = len(vecs)
+        capacity = max(64, 2 * n)
+        mat = np.empty((capacity, len(vecs[0])), dtype=np.float32)
+        mat[:n] = np.vstack(vecs)
+        self._matrix = mat
+        self._matrix_n = n
+        self._matrix_ids = ids
+        return mat[:n]
+
+    def _matrix_append(self, vec, pos: int):
+        """
+        [Perf] Amortized O(d) insert into the live matrix: write the new row
+        in place, doubling the backing array only when capacity runs out.
+        """
+        if self._matrix_n >= self._matrix.shape[0]:
+            grown = np.empty(
+                (self._matrix.shape[0] * 2, self._matrix.shape[1]),
+                dtype=np.float32
+            )
+            grown[:self._matrix_n] = self._matrix[:self._matrix_n]
+            self._matrix = grown
+        self._matrix[self._matrix_n] = vec
+        self._matrix_n += 1
+        self._matrix_ids.append(pos)
+
+    def _rank(self, query_embed, top_k: int) -> List[tuple]:
+        """
+        Score the query against every stored memory and return the best
+        (score, memory) pairs, descending. Picks the fastest available
+        backend: FAISS index > NumPy matmul > pure-Python scan.
+        """
+        index = self._ensure_index()
+        if index is not None:
+            q = np.asarray([query_embed], dtype="float32")
+            faiss.normalize_L2(q)
+            scores, rows = index.search(q, min(top_k, index.ntotal))
+            return [
+                (float(s), self.memories[self._index_ids[r]])
+                for s, r in zip(scores[0], rows[0]) if r >= 0
+            ]
+
+        matrix = self._ensure_matrix()
+        if matrix is not None:
+            q = np.asarray(query_embed, dtype=np.float32)
+            qn = np.linalg.norm(q)
+            if qn:
+                q = q / qn
+            if simsimd is not None:
+                # cdist yields cosine DISTANCE; rows are unit-norm, so
+                # similarity is just 1 - distance.
+                scores = 1.0 - np.asarray(simsimd.cdist(q[None, :], matrix, metric="cos"))[0]
+            elif _numba_scan is not None:
+                scores = _numba_scan(matrix, q)
+            else:
+                scores = matrix @ q
+            k = min(top_k, len(scores))
+            # Partial top-K selection, then sort only those K
+            idx = np.argpartition(-scores, k - 1)[:k]
+            idx = idx[np.argsort(-scores[idx])]
+            return [
+                (float(scores[i]), self.memories[self._matrix_ids[i]])
+                for i in idx
+            ]
+
+        # [Perf] Pure-Python fallback: chunked scan with early abort. Once
+        # top_k candidates are held in a min-heap, each row's dot product is
+        # evaluated 64 dims at a time and bounded optimistically via
+        # Cauchy-Schwarz on the remaining energy - rows that provably can't
+        # beat the current k-th best stop early instead of finishing all d
+        # dims. Per-row squared norms are computed once and cached on the
+        # memory (underscore key, stripped before persistence).
+        q = list(query_embed)
+        q_norm_sq = sum(x * x for x in q)
+        if not q_norm_sq:
+            return []
+        q_norm = q_norm_sq ** 0.5
+        q_cum = []  # cumulative q energy, for the remaining-dims bound
+        acc = 0.0
+        for x in q:
+            acc += x * x
+            q_cum.append(acc)
+
+        chunk = 64
+        heap = []  # min-heap of (score, position) for the current top_k
+        for pos, mem in enumerate(self.memories):
+            vec = mem.get("_vec")
+            if vec is None:
+                vec = mem.get("embedding")
+            if vec is None or not len(vec):
+                continue
+            v_norm_sq = mem.get("_norm_sq")
+            if v_norm_sq is None:
+                v_norm_sq = sum(x * x for x in vec)
+                mem["_norm_sq"] = v_norm_sq
+            if not v_norm_sq:
+                continue
+            denom = q_norm * (v_norm_sq ** 0.5)
+            threshold = heap[0][0] if len(heap) >= top_k else None
+
+            d = min(len(q), len(vec))
+            pdot = 0.0
+            v_part = 0.0
+            aborted = False
+            for start in range(0, d, chunk):
+                end = min(start + chunk, d)
+                for j in range(start, end):
+                    pdot += q[j] * vec[j]
+                    v_part += vec[j] * vec[j]
+                if threshold is not None and end < d:
+                    rem = (q_norm_sq - q_cum[end - 1]) * (v_norm_sq - v_part)
+                    upper = (pdot + (rem ** 0.5 if rem > 0 else 0.0)) / denom
+                    if upper < threshold:
+                        aborted = True
+                        break
+            if aborted:
+                continue
+
+            entry = (pdot / denom, pos)
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+        heap.sort(reverse=True)
+        return [(score, self.memories[pos]) for score, pos in heap]
 
     def _get_embedding(self, text: str) -> List[float]:
         try:
             # Use 'retrieval_document' for storage
-            result = genai.embed_content(
-                model="models/text-embedding-004",
-                content=text,
-                task_type="retrieval_document",
-                title="Memory"
-            )
-            return result['embedding']
+            return list(_embed_cached(text, "retrieval_document", title="Memory"))
         except Exception as e:
             print(f"[Memory] Embedding failed: {e}")
             return []
@@ -83,70 +515,216 @@ class MemoryManager:
         # 2. Store
         memory_item = {
             "text": content,
-            "embedding": vector,
             "timestamp": time.time(),
             "metadata": metadata or {}
         }
-        self.memories.append(memory_item)
-        
-        # 3. Persist immediately
-        self.save_memories()
+        if np is not None:
+            # [Perf] Persist int8 + scale instead of 768 JSON floats
+            memory_item["q"], memory_item["scale"] = self._quantize(vector)
+        else:
+            memory_item["embedding"] = vector
+        self._attach_vec(memory_item)
+        # Held across the list append AND the log append so a concurrent
+        # snapshot can't land between them and duplicate the new line.
+        with self._lock:
+            self.memories.append(memory_item)
+            sid = memory_item["metadata"].get("source_id")
+            if sid:
+                self._by_source.setdefault(sid, []).append(len(self.memories) - 1)
+
+            # [Perf] Adds don't nuke the live search structures: the FAISS index
+            # appends the new vector in place (O(1) for flat, O(log N) for HNSW)
+            # and the dense matrix writes one row into its preallocated headroom,
+            # instead of forcing full O(N*d) rebuilds on the next query. Cached
+            # query results still reset.
+            self._query_cache.clear()
+            self._semantic_cache.clear()
+            vec = memory_item.get("_vec")
+            if self._matrix is not None and vec is not None:
+                self._matrix_append(vec, len(self.memories) - 1)
+            else:
+                self._matrix = None
+                self._matrix_n = 0
+                self._matrix_ids = []
+            if self._index is not None and vec is not None:
+                self._index.add(vec[None, :])
+                self._index_ids.append(len(self.memories) - 1)
+            else:
+                self._index = None
+                self._index_ids = []
+
+            # 3. Persist immediately (one appended line, not a full rewrite)
+            self._append_memory(memory_item)
+
+    def add_memories(self, contents: List[str], metadatas: List[Dict] = None) -> int:
+        """
+        [Perf] Batch insert: ONE embedding API call for every text and one
+        file append for all of them, instead of N round-trips + N writes.
+        Symmetric with delete_memory_by_sources on the removal side.
+        Returns the number of items actually stored.
+        """
+        if not contents:
+            return 0
+        if metadatas is None:
+            metadatas = [None] * len(contents)
+
+        print(f"[Memory] Batch adding {len(contents)} memories...")
+        try:
+            # Gemini accepts a list of contents and returns one vector each
+            result = genai.embed_content(
+                model="models/text-embedding-004",
+                content=list(contents),
+                task_type="retrieval_document",
+                title="Memory"
+            )
+            vectors = result['embedding']
+        except Exception as e:
+            print(f"[Memory] Batch embedding failed: {e}")
+            return 0
+
+        lines = []
+        with self._lock:
+            for content, vector, metadata in zip(contents, vectors, metadatas):
+                if not vector:
+                    continue
+                memory_item = {
+                    "text": content,
+                    "timestamp": time.time(),
+                    "metadata": metadata or {}
+                }
+                if np is not None:
+                    memory_item["q"], memory_item["scale"] = self._quantize(vector)
+                else:
+                    memory_item["embedding"] = vector
+                self._attach_vec(memory_item)
+                self.memories.append(memory_item)
+                sid = memory_item["metadata"].get("source_id")
+                if sid:
+                    self._by_source.setdefault(sid, []).append(len(self.memories) - 1)
+                lines.append(_dumps(self._clean(memory_item)))
+
+            if not lines:
+                return 0
+
+            self._invalidate_caches()
+            try:
+                with open(self.memory_file, 'a', encoding='utf-8') as f:
+                    f.write("\n".join(lines) + "\n")
+            except Exception as e:
+                print(f"[Memory] Batch append failed: {e}")
+        return len(lines)
 
     def delete_memory_by_source(self, source_id: str) -> int:
         """
         Delete memories linked to a specific source message ID.
+        [Perf] O(k) via the source index - no O(N) scan, and sources with
+        nothing stored return without touching anything.
         Returns count of deleted items.
         """
-        initial_count = len(self.memories)
-        self.memories = [
-            m for m in self.memories 
-            if m.get("metadata", {}).get("source_id") != source_id
-        ]
-        deleted_count = initial_count - len(self.memories)
-        
-        if deleted_count > 0:
+        with self._lock:
+            positions = self._by_source.pop(source_id, None)
+            if not positions:
+                return 0
+
+            deleted_count = self._delete_positions(positions)
             print(f"[Memory] Deleted {deleted_count} items via Source ID: {source_id}")
-            self.save_memories()
-        
+            self._invalidate_caches()
+            self._mark_dirty()
+        return deleted_count
+
+    def delete_memory_by_sources(self, source_ids: List[str]) -> int:
+        """
+        Bulk variant of delete_memory_by_source.
+        One filter pass + one save instead of N filter/save cycles.
+        Returns count of deleted items.
+        """
+        if not source_ids:
+            return 0
+
+        id_set = set(source_ids)
+        with self._lock:
+            positions = []
+            for sid in id_set:
+                positions.extend(self._by_source.pop(sid, []))
+            if not positions:
+                return 0
+
+            deleted_count = self._delete_positions(positions)
+            print(f"[Memory] Bulk deleted {deleted_count} items via {len(id_set)} Source IDs.")
+            self._invalidate_caches()
+            self._mark_dirty()
         return deleted_count
 
-    def _cosine_similarity(self, v1: List[float], v2: List[float]) -> float:
-        if not v1 or not v2: return 0.0
+    def _cosine_similarity(self, v1, v2) -> float:
+        if v1 is None or v2 is None or len(v1) == 0 or len(v2) == 0:
+            return 0.0
+        if np is not None:
+            # [Perf] BLAS dot + norms: one SIMD pass instead of three
+            # interpreted loops over 768 floats.
+            a = np.asarray(v1, dtype=np.float32)
+            b = np.asarray(v2, dtype=np.float32)
+            denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+            if denom == 0.0:
+                return 0.0
+            return float(np.dot(a, b)) / denom
         dot_product = sum(a*b for a,b in zip(v1, v2))
         magnitude1 = sum(a*a for a in v1) ** 0.5
         magnitude2 = sum(b*b for b in v2) ** 0.5
         if magnitude1 == 0 or magnitude2 == 0: return 0.0
         return dot_product / (magnitude1 * magnitude2)
 
-    def query_memory(self, query: str, top_k: int = 3) -> str:
+    def query_memory(self, query: str, top_k: int = 3, query_vec=None) -> str:
+        """
+        query_vec: optional precomputed embedding for `query` - callers that
+        run several retrievals for the same utterance in one turn can embed
+        once and pass it, skipping the embed round-trip entirely.
+        """
         if not self.memories:
             return ""
 
+        # [Perf] Cache hit = no embed round-trip, no search, no formatting.
+        cache_key = hashlib.sha256(f"{top_k}:{query}".encode("utf-8")).hexdigest()
+        now = time.time()
+        cached = self._query_cache.get(cache_key)
+        if cached and cached[0] > now:
+            self._query_cache.move_to_end(cache_key)
+            return cached[1]
+
         print(f"[Memory] Searching for: '{query}'")
-        
-        # 1. Embed Query
-        try:
-            query_embed = genai.embed_content(
-                model="models/text-embedding-004",
-                content=query,
-                task_type="retrieval_query"
-            )['embedding']
-        except Exception as e:
-            print(f"[Memory] Query embedding failed: {e}")
-            return ""
 
-        # 2. Rank
-        scored_memories = []
-        for mem in self.memories:
-            score = self._cosine_similarity(query_embed, mem["embedding"])
-            scored_memories.append((score, mem))
+        # 1. Embed Query (memoized for repeat text; skipped when the caller
+        # already holds the vector)
+        if query_vec is not None:
+            query_embed = tuple(query_vec)
+        else:
+            try:
+                query_embed = _embed_cached(query, "retrieval_query")
+            except Exception as e:
+                print(f"[Memory] Query embedding failed: {e}")
+                return ""
+
+        # 1.5 Semantic near-match: paraphrases of a recent query short-circuit
+        q_norm = None
+        if np is not None:
+            q_norm = np.asarray(query_embed, dtype=np.float32)
+            n = np.linalg.norm(q_norm)
+            if n:
+                q_norm = q_norm / n
+            # Only entries produced with the same top_k are candidates - a
+            # paraphrase hit must not hand back a result formatted for a
+            # different result count.
+            candidates = [(v, r) for v, k, r in self._semantic_cache if k == top_k]
+            if candidates:
+                sims = np.vstack([v for v, _ in candidates]) @ q_norm
+                best = int(np.argmax(sims))
+                if sims[best] >= _SEMANTIC_CACHE_THRESHOLD:
+                    print(f"  - Semantic cache hit ({sims[best]:.4f})")
+                    return candidates[best][1]
+
+        # 2. Rank (FAISS index > batched matmul > brute-force scan)
+        top_results = self._rank(query_embed, top_k)
 
-        # Sort descending
-        scored_memories.sort(key=lambda x: x[0], reverse=True)
-        
         # 3. Filter and Format
-        top_results = scored_memories[:top_k]
-        
         # Filter low relevance? (Optional)
         # top_results = [m for m in top_results if m[0] > 0.4]
 
@@ -155,33 +733,34 @@ class MemoryManager:
             print(f"  - Found (Score {score:.4f}): {mem['text'][:50]}...")
             format_list.append(f"- {mem['text']}")
 
-        if not format_list:
-            return ""
+        result = "【相关长期记忆】:\n" + "\n".join(format_list) if format_list else ""
+
+        self._query_cache[cache_key] = (now + _QUERY_CACHE_TTL, result)
+        if len(self._query_cache) > _QUERY_CACHE_MAX:
+            self._query_cache.popitem(last=False)
 
-        return "【相关长期记忆】:\n" + "\n".join(format_list)
+        if q_norm is not None:
+            self._semantic_cache.append((q_norm, top_k, result))
+            if len(self._semantic_cache) > _SEMANTIC_CACHE_MAX:
+                self._semantic_cache.pop(0)
+
+        return result
 
     def get_all_memories(self) -> List[Dict]:
-        return self.memories
+        # Cleaned copies: callers get JSON-safe dicts, not the cached ndarrays
+        return [self._clean(m) for m in self.memories]
 
-    def query_contextual(self, context_desc: str, top_k: int = 5) -> List[str]:
+    def query_contextual(self, context_desc: str, top_k: int = 5, query_vec=None) -> List[str]:
         # Alias for query_memory logic but returning raw list
         # We reuse query_memory for simplicity or duplicate logic
         # For now, let's keep it simple
+        # query_vec: optional precomputed embedding, see query_memory
         if not self.memories: return []
-        
+
         try:
-            query_embed = genai.embed_content(
-                model="models/text-embedding-004",
-                content=context_desc,
-                task_type="retrieval_query"
-            )['embedding']
-            
-            scored = []
-            for mem in self.memories:
-                score = self._cosine_similarity(query_embed, mem["embedding"])
-                scored.append((score, mem))
-            
-            scored.sort(key=lambda x: x[0], reverse=True)
-            return [m[1]["text"] for m in scored[:top_k]]
+            query_embed = tuple(query_vec) if query_vec is not None \
+                else _embed_cached(context_desc, "retrieval_query")
+
+            return [mem["text"] for _, mem in self._rank(query_embed, top_k)]
         except:
             return []
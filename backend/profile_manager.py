@@ -1,13 +1,94 @@
+import atexit
 import json
 import os
+import threading
 import time
 from typing import Dict, List, Any
 
+# [Perf] Optional NumPy: the smoothing blends run as one vectorized op
+# instead of a per-key Python loop. Falls back to the scalar math.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _smooth(old_d: Dict, new_d: Dict, alpha: float) -> Dict:
+    """
+    指数平滑 (Exponential Smoothing): blended = old*alpha + new*(1-alpha)。
+    Keys missing from the old dict take the new value as-is.
+    """
+    if not old_d:
+        return new_d  # 初始化
+    if np is not None:
+        # float64 + a final Python round: float32 would persist artifacts
+        # like 7.800000190734863 into user_profile.json (and the prompt).
+        keys = list(new_d)
+        vn = np.fromiter((float(new_d[k]) for k in keys), dtype=np.float64, count=len(keys))
+        vo = np.fromiter(
+            (float(old_d.get(k, new_d[k])) for k in keys),
+            dtype=np.float64, count=len(keys)
+        )
+        blended = vo * alpha + vn * (1.0 - alpha)
+        return {k: round(float(v), 1) for k, v in zip(keys, blended)}
+    merged = {}
+    for k, v_new in new_d.items():
+        v_old = old_d.get(k)
+        if v_old is not None:
+            # 保留一位小数
+            merged[k] = round((v_old * alpha) + (v_new * (1 - alpha)), 1)
+        else:
+            merged[k] = v_new
+    return merged
+
+
 class ProfileManager:
     def __init__(self, profile_path: str = "./data/user_profile.json"):
         self.profile_path = profile_path
         self._ensure_data_dir()
         self.profile = self._load_profile()
+        # [Concurrency] The deferred write runs on a Timer thread while
+        # save_profile mutates self.profile on the event-loop thread; one
+        # reentrant lock covers both so the dump can't race an update.
+        self._lock = threading.RLock()
+        # [Perf] Write coalescing (same pattern as CareManager): updates mark
+        # dirty and schedule one deferred disk write instead of rewriting the
+        # file on every save_profile call.
+        self._dirty = False
+        self._flush_interval = 0.5
+        self._flush_timer: threading.Timer = None
+        atexit.register(self.flush)
+
+    def _mark_dirty(self):
+        """Schedule a single deferred _write_profile (cancel-and-reschedule)."""
+        with self._lock:
+            self._dirty = True
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(self._flush_interval, self._write_profile)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """Force any pending coalesced write to disk immediately."""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._dirty:
+                self._write_profile()
+
+    def _write_profile(self):
+        with self._lock:
+            try:
+                with open(self.profile_path, "w", encoding="utf-8") as f:
+                    json.dump(self.profile, f, ensure_ascii=False, indent=2)
+                # Cleared only after a successful dump - a failed write stays
+                # dirty and retries on the next flush.
+                self._dirty = False
+                print(f"[Profile] Updated Ocean: {self.profile.get('traits_ocean')}")
+            except Exception as e:
+                print(f"[Profile] Save failed: {e}")
 
     def _ensure_data_dir(self):
         os.makedirs(os.path.dirname(self.profile_path), exist_ok=True)
@@ -39,56 +120,23 @@ class ProfileManager:
         # 更新时间
         profile_data["last_updated"] = time.time()
         
-        # 1. 提取并平滑数值特质
-        alpha = 0.6 # 稳定性系数 (0.6 = 均衡, 允许更快迭代)
-        
-        # 辅助函数：平滑字典
-        def smooth_dict(old_dict, new_dict):
-            if not old_dict: return new_dict # 初始化
-            merged = {}
-            for k, v_new in new_dict.items():
-                v_old = old_dict.get(k)
-                if v_old is not None:
-                    # 保留一位小数
-                    merged[k] = round((v_old * alpha) + (v_new * (1 - alpha)), 1)
-                else:
-                    merged[k] = v_new
-            return merged
-
-        # 处理 OCEAN
-        new_ocean = profile_data.get("traits_ocean")
-        if new_ocean:
-            old_ocean = self.profile.get("traits_ocean", {})
-            profile_data["traits_ocean"] = smooth_dict(old_ocean, new_ocean)
-
-        # 处理 State (状态可以波动大一点，alpha 调低?)
-        # 暂时保持一致，或者让状态更敏感 (alpha=0.5)
-        new_state = profile_data.get("state_current")
-        if new_state:
-            old_state = self.profile.get("state_current", {})
-            # State alpha = 0.4 (对当前状态更敏感)
-            state_alpha = 0.4
-            def smooth_state(old_d, new_d):
-                if not old_d: return new_d
-                m = {}
-                for k, vn in new_d.items():
-                    vo = old_d.get(k)
-                    if vo is not None:
-                        m[k] = round((vo * state_alpha) + (vn * (1 - state_alpha)), 1)
-                    else:
-                        m[k] = vn
-                return m
-            profile_data["state_current"] = smooth_state(old_state, new_state)
-        
-        # 3. 覆盖文本字段
-        self.profile.update(profile_data)
-        
-        try:
-            with open(self.profile_path, "w", encoding="utf-8") as f:
-                json.dump(self.profile, f, ensure_ascii=False, indent=2)
-            print(f"[Profile] Updated Ocean: {self.profile.get('traits_ocean')}")
-        except Exception as e:
-            print(f"[Profile] Save failed: {e}")
+        with self._lock:
+            # 1. 提取并平滑数值特质 (见模块级 _smooth)
+            # 处理 OCEAN - 稳定性系数 0.6 (均衡, 允许更快迭代)
+            new_ocean = profile_data.get("traits_ocean")
+            if new_ocean:
+                old_ocean = self.profile.get("traits_ocean", {})
+                profile_data["traits_ocean"] = _smooth(old_ocean, new_ocean, 0.6)
+
+            # 处理 State - alpha 0.4 (对当前状态更敏感)
+            new_state = profile_data.get("state_current")
+            if new_state:
+                old_state = self.profile.get("state_current", {})
+                profile_data["state_current"] = _smooth(old_state, new_state, 0.4)
+
+            # 3. 覆盖文本字段
+            self.profile.update(profile_data)
+            self._mark_dirty()
 
     def get_profile_context(self) -> str:
         """
@@ -3,6 +3,30 @@ import os
 import time
 from typing import List, Dict, Any
 
+# [Perf] orjson serializes the long Unicode strings in history turns 3-10x
+# faster than stdlib json. Optional - falls back to stdlib when missing.
+try:
+    import orjson
+
+    def _dumps(obj, indent: bool = False) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj, indent: bool = False) -> str:
+        return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+    _loads = json.loads
+
+# [Perf] Read whole documents through a 64KB buffer: session files with long
+# histories span many default-sized (8KB) reads, so a bigger buffer means
+# fewer read() syscalls per load. _loads accepts the raw bytes directly.
+_READ_BUF = 65536
+
+def _read_bytes(filepath: str) -> bytes:
+    with open(filepath, "rb", buffering=_READ_BUF) as f:
+        return f.read()
+
 # Ensure Absolute Path for Data
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
@@ -18,46 +42,153 @@ def ensure_dirs():
 def get_session_file(session_id: str) -> str:
     return os.path.join(SESSIONS_DIR, f"{session_id}.json")
 
+# [Perf] Sessions catalog: one small index file (id -> updated_at/preview)
+# instead of opening + parsing EVERY session document on list_sessions /
+# startup. Maintained on the same events that write the base documents.
+INDEX_FILE = os.path.join(DATA_DIR, "sessions_index.json")
+
+def _load_index() -> Dict[str, Dict]:
+    if not os.path.exists(INDEX_FILE):
+        return {}
+    try:
+        data = _loads(_read_bytes(INDEX_FILE))
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        print(f"[Storage] Error reading sessions index: {e}")
+        return {}
+
+def _save_index(index: Dict[str, Dict]):
+    try:
+        with open(INDEX_FILE, "w", encoding="utf-8") as f:
+            f.write(_dumps(index))
+    except Exception as e:
+        print(f"[Storage] Error writing sessions index: {e}")
+
+def _index_update(session_id: str, updated_at: float, preview: str):
+    index = _load_index()
+    index[session_id] = {"id": session_id, "updated_at": updated_at, "preview": preview}
+    _save_index(index)
+
+def _index_remove(session_id: str):
+    index = _load_index()
+    if index.pop(session_id, None) is not None:
+        _save_index(index)
+
+# [Perf] Append-only sidecars. save_session rewrites the WHOLE document per
+# turn - O(history) disk I/O per message. New history/log entries go to JSONL
+# sidecars instead (one O(1) append each); the base .json only gets rewritten
+# on real compaction (delete/load), at which point the sidecars fold in.
+def _history_sidecar(session_id: str) -> str:
+    return os.path.join(SESSIONS_DIR, f"{session_id}.history.jsonl")
+
+def _logs_sidecar(session_id: str) -> str:
+    return os.path.join(SESSIONS_DIR, f"{session_id}.logs.jsonl")
+
+def _read_sidecar(filepath: str) -> List[Dict]:
+    if not os.path.exists(filepath):
+        return []
+    entries = []
+    try:
+        with open(filepath, "r", encoding="utf-8", buffering=_READ_BUF) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(_loads(line))
+                except Exception:
+                    pass  # Skip corrupt tail (e.g. crash mid-append)
+    except Exception as e:
+        print(f"[Storage] Error reading sidecar {filepath}: {e}")
+    return entries
+
+def _append_jsonl(filepath: str, entry: Dict):
+    with open(filepath, "a", encoding="utf-8") as f:
+        f.write(_dumps(entry) + "\n")
+
+def append_history_entry(session_id: str, entry: Dict):
+    """O(1) persistence of one new history turn (vs full-session rewrite)."""
+    ensure_dirs()
+    try:
+        filepath = get_session_file(session_id)
+        parts = entry.get("parts")
+        preview = parts[0][:50] if isinstance(parts, list) and parts else "Empty"
+        if not os.path.exists(filepath):
+            # First message of a lazily-created session: write a minimal base
+            # doc once so list_sessions can discover it.
+            with open(filepath, "w", encoding="utf-8") as f:
+                f.write(_dumps({
+                    "id": session_id,
+                    "updated_at": time.time(),
+                    "history": [],
+                    "logs": [],
+                    "preview": preview
+                }, indent=True))
+        _append_jsonl(_history_sidecar(session_id), entry)
+        # Touch the catalog on EVERY turn: list_sessions orders by updated_at
+        # and startup resumes sessions[0], so a stale entry would surface the
+        # wrong session (and preview) once save_session stopped running per
+        # message.
+        _index_update(session_id, time.time(), preview)
+    except Exception as e:
+        print(f"[Storage] Error appending history for {session_id}: {e}")
+
+def append_log_entry(session_id: str, entry: Dict):
+    """O(1) persistence of one new thought log."""
+    ensure_dirs()
+    try:
+        _append_jsonl(_logs_sidecar(session_id), entry)
+    except Exception as e:
+        print(f"[Storage] Error appending log for {session_id}: {e}")
+
 def load_session(session_id: str) -> Dict[str, Any]:
     ensure_dirs()
     filepath = get_session_file(session_id)
-    if not os.path.exists(filepath):
-        return {"history": [], "logs": []}
-    try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            
+    clean_history: List[Dict] = []
+    logs: List[Dict] = []
+    if os.path.exists(filepath):
+        try:
+            data = _loads(_read_bytes(filepath))
+
             # Sanitize History to prevent 'str' errors
             raw_history = data.get("history", [])
-            if isinstance(data, list): raw_history = data # Legacy support 
-            
+            if isinstance(data, list): raw_history = data # Legacy support
+
             clean_history = [
-                item for item in raw_history 
+                item for item in raw_history
                 if isinstance(item, dict) and "role" in item
             ]
-            
-            return {
-                "history": clean_history,
-                "logs": data.get("logs", []) if isinstance(data, dict) else []
-            }
-    except Exception as e:
-        print(f"[Storage] Error loading session {session_id}: {e}")
-        return {"history": [], "logs": []}
+            logs = data.get("logs", []) if isinstance(data, dict) else []
+        except Exception as e:
+            print(f"[Storage] Error loading session {session_id}: {e}")
+            return {"history": [], "logs": []}
+
+    # [Perf] Fold in the append-only sidecar tails (entries since last rewrite)
+    clean_history.extend(
+        item for item in _read_sidecar(_history_sidecar(session_id))
+        if isinstance(item, dict) and "role" in item
+    )
+    logs.extend(_read_sidecar(_logs_sidecar(session_id)))
+
+    return {"history": clean_history, "logs": logs}
 
 def save_session(session_id: str, history: List[Dict], logs: List[Dict] = None):
     ensure_dirs()
     filepath = get_session_file(session_id)
     
-    # Preserve existing logs if not provided
+    # [Perf] Callers that hold the logs in memory should pass them - this
+    # fallback re-reads and re-parses the whole document (base doc + sidecar
+    # tail, since the sidecars get retired below) just to preserve them.
     existing_logs = []
-    if logs is None and os.path.exists(filepath):
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                old_data = json.load(f)
+    if logs is None:
+        if os.path.exists(filepath):
+            try:
+                old_data = _loads(_read_bytes(filepath))
                 if isinstance(old_data, dict):
                     existing_logs = old_data.get("logs", [])
-        except: pass
-    
+            except: pass
+        existing_logs.extend(_read_sidecar(_logs_sidecar(session_id)))
+
     final_logs = logs if logs is not None else existing_logs
     
     data = {
@@ -74,28 +205,72 @@ def save_session(session_id: str, history: List[Dict], logs: List[Dict] = None):
     
     try:
         with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write(_dumps(data, indent=True))
+        # [Compaction] The full state is now in the base document - retire the
+        # append-only sidecars so entries aren't replayed twice on next load.
+        for sidecar in (_history_sidecar(session_id), _logs_sidecar(session_id)):
+            try:
+                os.remove(sidecar)
+            except FileNotFoundError:
+                pass
+        _index_update(session_id, data["updated_at"], data["preview"])
     except Exception as e:
         print(f"[Storage] Error saving session {session_id}: {e}")
 
 # --- Persistent Tasks (The "Notebook") ---
-TASKS_FILE = os.path.join(DATA_DIR, "scheduled_tasks.json")
+# [Perf] Sharded per session: tasks/<session_id>.json. Every mutation now
+# rewrites one small shard instead of the combined file for ALL sessions,
+# and clearing a session's tasks is a single os.remove. The legacy
+# single-file store migrates into shards once on first access.
+TASKS_DIR = os.path.join(DATA_DIR, "tasks")
+TASKS_FILE = os.path.join(DATA_DIR, "scheduled_tasks.json")  # legacy store
+
+def _tasks_file(session_id: str) -> str:
+    return os.path.join(TASKS_DIR, f"{session_id}.json")
 
-def _load_all_tasks() -> List[Dict]:
+def _migrate_legacy_tasks():
+    """[Migration] One-shot split of the combined tasks file into shards."""
     if not os.path.exists(TASKS_FILE):
+        return
+    try:
+        legacy = _loads(_read_bytes(TASKS_FILE))
+    except:
+        legacy = []
+    shards: Dict[str, List[Dict]] = {}
+    if isinstance(legacy, list):
+        for task in legacy:
+            if isinstance(task, dict):
+                shards.setdefault(task.get("session_id", "unknown"), []).append(task)
+    for sid, tasks in shards.items():
+        _save_session_tasks(sid, tasks)
+    os.replace(TASKS_FILE, TASKS_FILE + ".bak")
+    print(f"[Storage] Migrated legacy tasks into {len(shards)} shard(s).")
+
+def _load_session_tasks(session_id: str) -> List[Dict]:
+    _migrate_legacy_tasks()
+    filepath = _tasks_file(session_id)
+    if not os.path.exists(filepath):
         return []
     try:
-        with open(TASKS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        tasks = _loads(_read_bytes(filepath))
+        return tasks if isinstance(tasks, list) else []
     except:
         return []
 
-def _save_all_tasks(tasks: List[Dict]):
+def _save_session_tasks(session_id: str, tasks: List[Dict]):
     try:
-        with open(TASKS_FILE, "w", encoding="utf-8") as f:
-            json.dump(tasks, f, ensure_ascii=False, indent=2)
+        if not tasks:
+            # Empty shard = no file; keeps the directory tidy
+            try:
+                os.remove(_tasks_file(session_id))
+            except FileNotFoundError:
+                pass
+            return
+        os.makedirs(TASKS_DIR, exist_ok=True)
+        with open(_tasks_file(session_id), "w", encoding="utf-8") as f:
+            f.write(_dumps(tasks, indent=True))
     except Exception as e:
-        print(f"[Storage] Error saving tasks: {e}")
+        print(f"[Storage] Error saving tasks for {session_id}: {e}")
 
 def add_scheduled_task(session_id: str, task_data: Dict):
     """
@@ -103,56 +278,108 @@ def add_scheduled_task(session_id: str, task_data: Dict):
     task_data: { "id": uuid, "trigger_time": float, "action": str, "thought": dict }
     """
     ensure_dirs()
-    tasks = _load_all_tasks()
+    tasks = _load_session_tasks(session_id)
     # Add session_id to data
     task_data["session_id"] = session_id
     tasks.append(task_data)
-    _save_all_tasks(tasks)
+    _save_session_tasks(session_id, tasks)
     print(f"[Storage] Task persisted: {task_data.get('action')} @ {task_data.get('trigger_time')}")
 
 def get_scheduled_tasks(session_id: str) -> List[Dict]:
     """Get all pending tasks for a specific session."""
-    all_tasks = _load_all_tasks()
-    return [t for t in all_tasks if t.get("session_id") == session_id]
+    return _load_session_tasks(session_id)
 
-def remove_scheduled_task(task_id: str):
-    """Remove a task after it's done or cancelled."""
-    tasks = _load_all_tasks()
-    new_tasks = [t for t in tasks if t.get("id") != task_id]
-    if len(tasks) != len(new_tasks):
-        _save_all_tasks(new_tasks)
-        print(f"[Storage] Task {task_id} removed.")
+def remove_scheduled_task(task_id: str, session_id: str = None):
+    """
+    Remove a task after it's done or cancelled.
+    Pass session_id where known - it pins the lookup to one shard; without
+    it every shard is scanned (legacy signature compatibility).
+    """
+    if session_id is not None:
+        shard_ids = [session_id]
+    else:
+        _migrate_legacy_tasks()
+        if not os.path.isdir(TASKS_DIR):
+            return
+        shard_ids = [f[:-5] for f in os.listdir(TASKS_DIR) if f.endswith(".json")]
+
+    for sid in shard_ids:
+        tasks = _load_session_tasks(sid)
+        new_tasks = [t for t in tasks if t.get("id") != task_id]
+        if len(tasks) != len(new_tasks):
+            _save_session_tasks(sid, new_tasks)
+            print(f"[Storage] Task {task_id} removed.")
+            return
 
 def clear_session_tasks(session_id: str):
     """
     [Interrupt] Clear ALL pending tasks for a specific session.
     Used when user speaks, invalidating all previous future plans.
+    One unlink instead of load-filter-rewrite of a combined file.
     """
-    tasks = _load_all_tasks()
-    original_count = len(tasks)
-    new_tasks = [t for t in tasks if t.get("session_id") != session_id]
-    
-    if len(new_tasks) < original_count:
-        _save_all_tasks(new_tasks)
-        print(f"[Storage] Cleared {original_count - len(new_tasks)} tasks for session {session_id}")
+    _migrate_legacy_tasks()
+    try:
+        os.remove(_tasks_file(session_id))
+        print(f"[Storage] Cleared tasks for session {session_id}")
+    except FileNotFoundError:
+        pass
 
-def list_sessions() -> List[Dict]:
-    ensure_dirs()
-    sessions = []
+def session_cleanup(session_id: str) -> Dict[str, int]:
+    """
+    [Unit of Work] Remove everything storage owns for a session in one shot:
+    the per-session tasks shard (one unlink) and the session file itself.
+    One write path instead of separate clear-tasks / delete-file round
+    trips. Returns counts for reporting.
+    """
+    cleared = len(_load_session_tasks(session_id))
+    if cleared:
+        clear_session_tasks(session_id)
+
+    removed = 0
+    try:
+        os.remove(get_session_file(session_id))
+        removed = 1
+    except FileNotFoundError:
+        pass
+    for sidecar in (_history_sidecar(session_id), _logs_sidecar(session_id)):
+        try:
+            os.remove(sidecar)
+        except FileNotFoundError:
+            pass
+    _index_remove(session_id)
+
+    return {"tasks_cleared": cleared, "session_removed": removed}
+
+def _rebuild_index() -> Dict[str, Dict]:
+    """
+    [Migration] One-shot legacy scan: parse every session document once to
+    seed the catalog, then persist it so later calls are a single read.
+    """
+    index = {}
     for filename in os.listdir(SESSIONS_DIR):
         if filename.endswith(".json"):
             filepath = os.path.join(SESSIONS_DIR, filename)
             try:
-                with open(filepath, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    sessions.append({
-                        "id": data.get("id", filename.replace(".json", "")),
-                        "updated_at": data.get("updated_at", 0),
-                        "preview": data.get("preview", "No preview")
-                    })
+                data = _loads(_read_bytes(filepath))
+                session_id = data.get("id", filename.replace(".json", ""))
+                index[session_id] = {
+                    "id": session_id,
+                    "updated_at": data.get("updated_at", 0),
+                    "preview": data.get("preview", "No preview")
+                }
             except Exception as e:
                 print(f"[Storage] Error loading session {filename}: {e}")
-    
+    _save_index(index)
+    return index
+
+def list_sessions() -> List[Dict]:
+    ensure_dirs()
+    # [Perf] One catalog read instead of parsing N session files per call.
+    index = _load_index()
+    if not index:
+        index = _rebuild_index()
+
+    sessions = list(index.values())
     # Sort by updated_at desc
     sessions.sort(key=lambda x: x["updated_at"], reverse=True)
     return sessions